@@ -1,21 +1,33 @@
+import argparse
+import base64
 import datetime
+import functools
+import json
 import mimetypes
 import re
+import threading
+import time
 import uuid
 
-from flask import Flask, request, send_from_directory, make_response, jsonify, current_app, send_file
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, request, send_from_directory, make_response, jsonify, current_app, send_file
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 from core.config.config import BaseConfig
-from core.img_process.img_process import img_process
-from core.video.code_video.code_video import video_process
-from core.video.video_process.mainProcess import countCar
-from core.camera.camera import track_cam
-from core.camera.screen_low import capture
-from core.camera.modify import capture_and_detect
+from core.database.database import db, init_db, DbWriter, Upload, Detection, Plate, row_to_dict
+from core.metrics import metrics
+from core.model_registry.model_registry import ModelRegistry
+from core.img_process.batcher import InferenceBatcher
+from core.job_queue.job_queue import JobManager
+from core.storage.memory_store import MemoryStore
+from core.storage.storage_manager import StorageManager
+from core.result_cache.result_cache import ResultCache, make_key
+from core.plate_index.plate_index import PlateIndex
+from core.video.segment.segment import SegmentRunner
+# 推理、视频与摄像头模块依赖 torch / ultralytics / mss 等重型库，在各路由首次使用时才导入
+from core.camera.session import SessionManager, SourceBusy
 
 
 # app是Flask构建的实例
@@ -25,23 +37,82 @@ app.config.from_object(BaseConfig)
 # 文件存储路径
 TMP_CT_FOLDER = './tmp/ct'
 TMP_DRAW_FOLDER = './tmp/draw'
+# 处理中文件的锁定标记，供多进程模式下执行清理的进程查看
+TMP_PIN_FOLDER = './tmp/pins'
 MODEL_PATH = './weights'
 app.config['UPLOAD_FOLDER'] = TMP_CT_FOLDER
 app.config['SAVE_FOLDER'] = TMP_DRAW_FOLDER
 app.config['MODEL_PATH'] = MODEL_PATH
 # 允许的文件类型
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'mov'}
+# 可通过 /tmp/<path> 访问的媒体类型
+MEDIA_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+               '.mp4': 'video/mp4', '.webm': 'video/webm', '.avi': 'video/x-msvideo', '.mov': 'video/quicktime',
+               '.jsonl': 'application/x-ndjson'}
 # 模型存储路径
 
-# 确保目标目录存在
-if not os.path.exists(TMP_CT_FOLDER):
-    os.makedirs(TMP_CT_FOLDER)
-if not os.path.exists(TMP_DRAW_FOLDER):
-    os.makedirs(TMP_DRAW_FOLDER)
 # 解决缓存刷新问题
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = timedelta(seconds=1)
-# 初始化扩展，传入app 创建db
-db = SQLAlchemy(app)
+# 车牌索引最近一次同步的时间
+plate_index_synced = [0.0]
+# 预派生多进程模式下本进程的编号与各工作进程内部端口的起始值，单进程模式下均为 None
+worker_state = {'index': None, 'workers': 1, 'port_base': None}
+# 转发请求的标记头，收到转发请求的进程不再继续转发
+FORWARDED_HEADER = 'X-Worker-Forwarded'
+
+
+def init_app():
+    # 建表与各后台服务。长视频分段的 spawn 工作进程会以 __mp_main__ 重新导入本文件，
+    # 它们只需要 core.video.segment 中的函数，不执行这里
+    global db_writer, model_registry, inference_batcher, job_manager, memory_store, result_cache, \
+        persist_executor, storage_manager, plate_index, camera_sessions, segment_runner
+    # 确保目标目录存在
+    if not os.path.exists(TMP_CT_FOLDER):
+        os.makedirs(TMP_CT_FOLDER)
+    if not os.path.exists(TMP_DRAW_FOLDER):
+        os.makedirs(TMP_DRAW_FOLDER)
+    # 初始化扩展，创建数据表；配置的数据库不可用时回退到本地 SQLite
+    init_db(app, fallback_uri=app.config['SQLALCHEMY_FALLBACK_URI'])
+    # 识别结果在后台批量写入数据库
+    db_writer = DbWriter(app, batch_size=app.config['DB_WRITE_BATCH_SIZE'],
+                         interval=app.config['DB_WRITE_INTERVAL'],
+                         max_queue=app.config['DB_WRITE_QUEUE_MAX'])
+    # 进程内共享的模型注册表，权重只加载一次
+    model_registry = ModelRegistry(max_bytes=app.config['MODEL_CACHE_MAX_BYTES'])
+    # 图片推理的动态微批处理调度器
+    inference_batcher = InferenceBatcher(model_registry.get,
+                                         max_batch_size=app.config['BATCH_MAX_SIZE'],
+                                         max_wait_ms=app.config['BATCH_MAX_WAIT_MS'])
+    # 视频后台任务队列
+    job_manager = JobManager(max_workers=app.config['JOB_MAX_WORKERS'],
+                             model_limits=app.config['JOB_MODEL_LIMITS'],
+                             default_model_limit=app.config['JOB_DEFAULT_MODEL_LIMIT'],
+                             max_history=app.config['JOB_MAX_HISTORY'])
+    # 不落盘的结果图片暂存在内存中，通过 /mem/<key> 短期访问
+    memory_store = MemoryStore(ttl=app.config['MEMORY_STORE_TTL'], max_items=app.config['MEMORY_STORE_MAX_ITEMS'])
+    # 重复上传图片的识别结果缓存
+    result_cache = ResultCache(max_bytes=app.config['RESULT_CACHE_MAX_BYTES'], ttl=app.config['RESULT_CACHE_TTL'])
+    # 异步落盘使用的后台线程
+    persist_executor = ThreadPoolExecutor(max_workers=1)
+    # ./tmp/ct 与 ./tmp/draw 的容量管理
+    storage_manager = StorageManager([TMP_CT_FOLDER, TMP_DRAW_FOLDER],
+                                     max_bytes=app.config['STORAGE_MAX_BYTES'],
+                                     max_age=app.config['STORAGE_MAX_AGE'],
+                                     interval=app.config['STORAGE_SWEEP_INTERVAL'],
+                                     pin_folder=TMP_PIN_FOLDER)
+    # 车牌精确/前缀/模糊检索索引，数据来自 plates 表
+    plate_index = PlateIndex()
+    # 摄像头/屏幕实时检测会话
+    camera_sessions = SessionManager(max_sessions=app.config['CAMERA_MAX_SESSIONS'],
+                                     max_history=app.config['CAMERA_MAX_HISTORY'],
+                                     quality=app.config['CAMERA_JPEG_QUALITY'])
+    # 长视频分段并行处理的进程池，首次使用时创建
+    segment_runner = SegmentRunner(workers=app.config['VIDEO_SEGMENT_WORKERS'],
+                                   min_seconds=app.config['VIDEO_SEGMENT_MIN_SECONDS'])
+
+
+if __name__ != '__mp_main__':
+    init_app()
 
 
 # 添加header解决跨域
@@ -50,7 +121,8 @@ def after_request(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     response.headers['Access-Control-Allow-Methods'] = 'POST'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Requested-With'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Requested-With, Range'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Range, Accept-Ranges, Content-Length, ETag'
     return response
 
 
@@ -63,15 +135,132 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def record_result(upload_id, kind, mode, conf, src_path, save_path, result_info, result_count=None):
+    # 识别结果放入写入队列，不阻塞请求
+    if kind == 'image':
+        result_info = [(1, result_info, None)] if result_info else []
+    result_info = result_info or []
+    db_writer.submit(Upload, id=upload_id, kind=kind, mode=mode, conf=conf, src_path=src_path,
+                     save_path=save_path, result_count=result_count if result_count is not None else len(result_info))
+    for seq, text, time_str in result_info:
+        if kind == 'video' and mode == 'car':
+            db_writer.submit(Plate, upload_id=upload_id, track_id=seq, plate=text, time=time_str)
+        else:
+            db_writer.submit(Detection, upload_id=upload_id, mode=mode, seq=seq, text=text, time=time_str)
+
+
+def write_file(path, data, stage='encode_write'):
+    with metrics.stage_timer(stage):
+        with open(path, 'wb') as f:
+            f.write(data)
+    storage_manager.track(path)
+
+
+def instrument(route):
+    # 统计各路由按模式划分的请求数与正在处理的请求数
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.is_json:
+                data = request.get_json(silent=True) or {}
+                mode = f"{data.get('key1', '')}{data.get('key2', '')}{data.get('key3', '')}"
+            else:
+                mode = request.form.get('mode', '')
+            with metrics.track_request(route, mode):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def owner_of(item_id):
+    # 任务 id 与内存文件 key 以 'w<编号>_' 开头，标明创建它的工作进程
+    match = re.match(r'w(\d+)_', item_id)
+    return int(match.group(1)) if match else None
+
+
+def forward(index):
+    # 把当前请求转发到 index 号工作进程的内部端口，响应按块流式返回（事件流与 MJPEG 推流同样适用）
+    import urllib.error
+    import urllib.request
+    url = f"http://127.0.0.1:{worker_state['port_base'] + index}{request.full_path}"
+    headers = {key: value for key, value in request.headers.items() if key.lower() not in ('host', 'content-length')}
+    headers[FORWARDED_HEADER] = '1'
+    upstream_request = urllib.request.Request(url, data=request.get_data() or None, headers=headers,
+                                              method=request.method)
+    try:
+        upstream = urllib.request.urlopen(upstream_request)
+    except urllib.error.HTTPError as e:
+        return make_response(e.read(), e.code, {'Content-Type': e.headers.get('Content-Type', 'text/plain')})
+    except urllib.error.URLError as e:
+        print("转发请求失败:", url, e)
+        return jsonify({'status': 0, 'error': 'Worker unavailable'}), 502
+
+    def body():
+        try:
+            while True:
+                chunk = upstream.read1(8192)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            upstream.close()
+
+    response = Response(body(), status=upstream.status, content_type=upstream.headers.get('Content-Type'))
+    for name in ('Cache-Control', 'X-Accel-Buffering'):
+        if upstream.headers.get(name):
+            response.headers[name] = upstream.headers[name]
+    return response
+
+
+def camera_owner(**kwargs):
+    # 摄像头会话统一由 0 号工作进程管理，不同进程不会同时打开同一设备
+    return 0
+
+
+def route_to_owner(get_owner):
+    # 预派生多进程模式下，请求的对象属于其他工作进程时转发过去处理
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            index = get_owner(**kwargs)
+            if (worker_state['index'] is not None and index is not None and index != worker_state['index']
+                    and index < worker_state['workers'] and not request.headers.get(FORWARDED_HEADER)):
+                return forward(index)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def gather_workers(path):
+    # 汇总其他工作进程的列表接口结果（JSON）
+    import urllib.request
+    results = []
+    if worker_state['index'] is None or request.headers.get(FORWARDED_HEADER):
+        return results
+    for index in range(worker_state['workers']):
+        if index == worker_state['index']:
+            continue
+        url = f"http://127.0.0.1:{worker_state['port_base'] + index}{path}"
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers={FORWARDED_HEADER: '1'}),
+                                        timeout=5) as upstream:
+                results.append(json.loads(upstream.read()))
+        except Exception as e:
+            print("汇总工作进程结果失败:", url, e)
+    return results
+
+
 @app.route('/')
 def index():
     return f"Current working directory: {os.getcwd()}"
 
 
 @app.route('/upload', methods=['POST'])
+@instrument('/upload')
 def upload_file():
     # 获取特定参数
-    mode = request.form.get('mode')
+    # 未指定模式时使用通用 yolo 模型，记录入库时 mode 不能为空
+    mode = request.form.get('mode') or 'yolo'
     conf = float(request.form.get('conf'))
     if 'file' not in request.files:
         return jsonify({'status': 0,
@@ -90,12 +279,38 @@ def upload_file():
             return jsonify({'status': 0,
                             'error': 'Unsupported file type'})
 
-        unique_filename = f"{uuid.uuid4().hex}{os.path.splitext(file.filename)[1]}"
+        from core.img_process.img_process import decode_image, predict_image, render_result, encode_image, \
+            encode_format, extract_detections
+        upload_id = uuid.uuid4().hex
+        unique_filename = f"{upload_id}{os.path.splitext(file.filename)[1]}"
         src_path = os.path.join(folder, unique_filename)
         src_path = src_path.replace('\\', '/')
-        save_path = os.path.join(app.config['SAVE_FOLDER'], unique_filename)
+        # 结果图按实际编码格式命名（如 gif 编码为 png）
+        draw_ext, draw_mime = encode_format(os.path.splitext(unique_filename)[1])
+        save_path = os.path.join(app.config['SAVE_FOLDER'], upload_id + draw_ext)
         save_path = save_path.replace('\\', '/')
-        file.save(src_path)
+        # 落盘方式：sync 同步写入，async 后台写入，none 不写入；结果返回方式：url 或 inline
+        persist = request.form.get('persist', app.config['UPLOAD_PERSIST_MODE'])
+        response_mode = request.form.get('response', 'url')
+        if persist not in ('sync', 'async', 'none') or response_mode not in ('url', 'inline'):
+            return jsonify({'status': 0,
+                            'error': 'Invalid persist or response'}), 400
+        # 输出内容：image 只返回识别字符串，boxes 另外返回边界框、置信度与类别；render=0 时不绘制也不保存结果图
+        output = request.form.get('output', 'image')
+        render = request.form.get('render', '1') != '0'
+        # tile=1 时按原图分辨率切片推理，tile_size / tile_overlap 可覆盖默认配置
+        tile = None
+        if request.form.get('tile') == '1':
+            tile = {'tile_size': request.form.get('tile_size', app.config['TILE_SIZE'], type=int),
+                    'overlap': request.form.get('tile_overlap', app.config['TILE_OVERLAP'], type=float),
+                    'skip_empty': app.config['TILE_SKIP_EMPTY'],
+                    'min_std': app.config['TILE_MIN_STD'],
+                    'nms_threshold': app.config['TILE_NMS_THRESHOLD'],
+                    'include_full': app.config['TILE_INCLUDE_FULL'],
+                    'batch_size': app.config['TILE_BATCH_SIZE']}
+            if tile['tile_size'] < 32 or not 0 <= tile['overlap'] < 0.9:
+                return jsonify({'status': 0,
+                                'error': 'Invalid tile_size or tile_overlap'})
         if mode == 'code':
             model_path = os.path.join(app.config['MODEL_PATH'], 'code.pt')
         elif mode == 'car':
@@ -103,21 +318,155 @@ def upload_file():
         else:
             model_path = os.path.join(app.config['MODEL_PATH'], 'yolo.pt')
 
-        # 调用核心处理功能
-        image_info = img_process(conf, model_path, src_path, save_path)
+        # 直接从请求流读取；内容相同的图片命中缓存时跳过解码与推理，缓存的结果图格式与本次输出一致
+        data = file.read()
+        variant = mode if tile is None else f"{mode}:tile:{tile['tile_size']}:{tile['overlap']}"
+        cache_key = make_key(data, f'{variant}:{draw_ext}', conf)
+        cached = result_cache.get(cache_key)
+        if cached is not None and (cached[1] is not None or not render):
+            image_info, draw_data, detections = cached
+        else:
+            orig_img = decode_image(data)
+            if orig_img is None:
+                return jsonify({'status': 0,
+                                'error': 'Cannot decode image'})
 
-        return jsonify({'status': 1,
-                        'image_url': f'http://127.0.0.1:5000/{src_path}',
-                        'draw_url': f'http://127.0.0.1:5000/{save_path}',
-                        'image_info': image_info})
+            # 调用核心处理功能
+            r, scale = predict_image(conf, model_path, orig_img, batcher=inference_batcher, tile=tile)
+            detections = extract_detections(r, scale)
+            if render:
+                im_array, image_info = render_result(r)
+                draw_data, draw_ext, draw_mime = encode_image(im_array, draw_ext)
+            else:
+                image_info, draw_data = detections['text'], None
+            result_cache.put(cache_key, image_info, draw_data, detections)
+
+        if not render:
+            draw_data = None
+            save_path = None
+        draw_url = None
+        if persist == 'sync':
+            write_file(src_path, data, 'upload_save')
+            image_url = f'http://127.0.0.1:5000/{src_path}'
+            if draw_data is not None:
+                write_file(save_path, draw_data)
+                draw_url = f'http://127.0.0.1:5000/{save_path}'
+        else:
+            if persist == 'async':
+                persist_executor.submit(write_file, src_path, data, 'upload_save')
+                if draw_data is not None:
+                    persist_executor.submit(write_file, save_path, draw_data)
+            image_url = f'http://127.0.0.1:5000/mem/{memory_store.put(data, mime_type)}'
+            if draw_data is not None:
+                draw_url = f'http://127.0.0.1:5000/mem/{memory_store.put(draw_data, draw_mime)}'
+        record_result(upload_id, 'image', mode, conf, src_path if persist != 'none' else None,
+                      save_path if persist != 'none' else None, image_info)
+
+        response = {'status': 1,
+                    'upload_id': upload_id,
+                    'image_url': image_url,
+                    'draw_url': draw_url,
+                    'image_info': image_info}
+        if output == 'boxes':
+            response['detections'] = {key: detections[key] for key in ('boxes', 'scores', 'classes', 'names')}
+        if response_mode == 'inline' and draw_data is not None:
+            response['draw_data'] = f'data:{draw_mime};base64,{base64.b64encode(draw_data).decode()}'
+        return jsonify(response)
 
     return jsonify({'status': 0, 'error': 'File type not allowed'})
 
 
+def video_model_key(mode):
+    # 视频任务按所用权重限制并发
+    if mode == 'code':
+        return 'code.pt'
+    elif mode == 'car':
+        return 'video.pt'
+    return 'yolo.pt'
+
+
+def process_video(mode, conf, src_path, save_path, progress=None, sample_fps=None, parallel=False, track_path=None):
+    # 处理期间锁定源文件与结果文件，避免被容量管理淘汰；save_path 为 None 时不输出标注视频，
+    # track_path 不为空时输出检测轨迹边车文件
+    paths = [path for path in (src_path, save_path, track_path) if path is not None]
+    storage_manager.pin(*paths)
+    try:
+        result = run_video(mode, conf, src_path, save_path, progress, sample_fps, parallel, track_path)
+        record_result(os.path.splitext(os.path.basename(src_path))[0], 'video', mode, conf, src_path, save_path,
+                      result['result_info'], result.get('result_count'))
+        return result
+    finally:
+        storage_manager.unpin(*paths)
+        for path in paths[1:]:
+            storage_manager.track(path)
+
+
+def run_video(mode, conf, src_path, save_path, progress=None, sample_fps=None, parallel=False, track_path=None):
+    draw_url = f'http://127.0.0.1:5000/{save_path}' if save_path is not None else None
+    track_url = f'http://127.0.0.1:5000/{track_path}' if track_path is not None else None
+    if mode == 'car':
+        from core.video.video_process.mainProcess import countCar
+        # 调用核心处理功能
+        YOLOmodelPath = os.path.join(app.config['MODEL_PATH'], 'video.pt')
+        LPRNetModelPath = os.path.join(app.config['MODEL_PATH'], 'lprnet_best.pth')
+        model = model_registry.get(YOLOmodelPath)
+        lprnet = model_registry.get(LPRNetModelPath)
+        # 跟踪器状态挂在模型上，整段视频处理期间独占该模型；跟踪 id 需要跨帧连续，不做分段并行
+        with model.lock:
+            model.reset_tracker()
+            car_list, car_count = countCar(YOLOmodelPath, LPRNetModelPath, src_path, save_path,
+                                           model=model, lprnet=lprnet, progress=progress,
+                                           queue_size=app.config['VIDEO_QUEUE_SIZE'],
+                                           batch_size=app.config['VIDEO_BATCH_SIZE'],
+                                           sample_fps=sample_fps, track_path=track_path,
+                                           fourcc=app.config['VIDEO_FOURCC'],
+                                           quality=app.config['VIDEO_QUALITY'])
+        return {'status': 1,
+                'video_url': f'http://127.0.0.1:5000/{src_path}',
+                'draw_url': draw_url,
+                'track_url': track_url,
+                'result_info': car_list,
+                'result_count': car_count
+                }
+    from core.video.code_video.code_video import video_process
+    model_path = os.path.join(app.config['MODEL_PATH'], video_model_key(mode))
+    frame_stats = {}
+    options = {'vote_window': app.config['VIDEO_VOTE_WINDOW'],
+               'min_votes': app.config['VIDEO_VOTE_MIN_VOTES'],
+               'min_agreement': app.config['VIDEO_VOTE_MIN_AGREEMENT'],
+               'queue_size': app.config['VIDEO_QUEUE_SIZE'],
+               'batch_size': app.config['VIDEO_BATCH_SIZE'],
+               # 场景变化门控只用于验证码视频，通用检测中小目标的移动可能低于整帧差异阈值
+               'scene_threshold': app.config['VIDEO_SCENE_THRESHOLD'] if mode == 'code' else 0,
+               'sample_fps': sample_fps,
+               'fourcc': app.config['VIDEO_FOURCC'],
+               'quality': app.config['VIDEO_QUALITY']}
+    segments = [(0, None)]
+    if parallel:
+        fps, total_frames, size, segments = segment_runner.plan(src_path)
+    if len(segments) > 1:
+        result_list = segment_runner.run(conf, model_path, src_path, save_path, segments, fps, total_frames, size,
+                                         progress=progress, stats=frame_stats, track_path=track_path, **options)
+        frame_stats['segments'] = len(segments)
+    else:
+        model = model_registry.get(model_path)
+        result_list = video_process(conf, model_path, src_path, save_path, model=model, progress=progress,
+                                    stats=frame_stats, track_path=track_path, **options)
+    return {'status': 1,
+            'video_url': f'http://127.0.0.1:5000/{src_path}',
+            'draw_url': draw_url,
+            'track_url': track_url,
+            'result_info': result_list,
+            'frame_stats': frame_stats
+            }
+
+
 @app.route('/upload_video', methods=['POST'])
+@instrument('/upload_video')
 def upload_video():
     # 获取特定参数
-    mode = request.form.get('mode')
+    # 未指定模式时使用通用 yolo 模型，记录入库时 mode 不能为空
+    mode = request.form.get('mode') or 'yolo'
     conf = float(request.form.get('conf'))
     if 'file' not in request.files:
         return jsonify({'status': 0,
@@ -142,38 +491,85 @@ def upload_video():
         src_path = src_path.replace('\\', '/')
         save_path = os.path.join(app.config['SAVE_FOLDER'], unique_filename)
         save_path = save_path.replace('\\', '/')
-        file.save(src_path)
-        if mode == 'code':
-            model_path = os.path.join(app.config['MODEL_PATH'], 'code.pt')
-            result_list = video_process(conf, model_path, src_path, save_path)
-            return jsonify({'status': 1,
-                            'video_url': f'http://127.0.0.1:5000/{src_path}',
-                            'draw_url': f'http://127.0.0.1:5000/{save_path}',
-                            'result_info': result_list
-                            })
-        elif mode == 'car':
-            # 调用核心处理功能
-            YOLOmodelPath = os.path.join(app.config['MODEL_PATH'], 'video.pt')
-            LPRNetModelPath = os.path.join(app.config['MODEL_PATH'], 'lprnet_best.pth')
-            car_list, car_count = countCar(YOLOmodelPath, LPRNetModelPath, src_path, save_path)
-            return jsonify({'status': 1,
-                            'video_url': f'http://127.0.0.1:5000/{src_path}',
-                            'draw_url': f'http://127.0.0.1:5000/{save_path}',
-                            'result_info': car_list,
-                            'result_count': car_count
-                            })
-        else:
-            model_path = os.path.join(app.config['MODEL_PATH'], 'yolo.pt')
-            result_list = video_process(conf, model_path, src_path, save_path)
+        # sample_fps 为目标分析帧率（0 为逐帧），annotate=0 时不输出标注视频
+        sample_fps = request.form.get('sample_fps', app.config['VIDEO_SAMPLE_FPS'], type=float)
+        if sample_fps is None or sample_fps < 0:
+            return jsonify({'status': 0,
+                            'error': 'Invalid sample_fps'})
+        # output：video 输出标注视频，track 只输出检测轨迹边车文件、不重新编码，both 两者都输出
+        output = request.form.get('output', app.config['VIDEO_OUTPUT'])
+        if output not in ('video', 'track', 'both'):
+            return jsonify({'status': 0,
+                            'error': 'Invalid output'})
+        track_path = None
+        if output != 'video':
+            track_path = os.path.join(app.config['SAVE_FOLDER'], f'{os.path.splitext(unique_filename)[0]}.jsonl')
+            track_path = track_path.replace('\\', '/')
+        if output == 'track' or request.form.get('annotate', '1') == '0':
+            save_path = None
+        # parallel=1 时长验证码视频按关键帧分段，在多个工作进程中并行处理
+        parallel = request.form.get('parallel') == '1'
+        with metrics.stage_timer('upload_save'):
+            file.save(src_path)
+        storage_manager.track(src_path)
+        # 异步模式：立即返回任务 id，视频在后台线程池中处理
+        if request.form.get('async') == '1':
+            job = job_manager.submit(video_model_key(mode), process_video,
+                                     mode=mode, conf=conf, src_path=src_path, save_path=save_path,
+                                     sample_fps=sample_fps, parallel=parallel, track_path=track_path)
             return jsonify({'status': 1,
+                            'job_id': job.id,
                             'video_url': f'http://127.0.0.1:5000/{src_path}',
-                            'draw_url': f'http://127.0.0.1:5000/{save_path}',
-                            'result_info': result_list
-                            })
+                            'status_url': f'http://127.0.0.1:5000/jobs/{job.id}',
+                            'events_url': f'http://127.0.0.1:5000/jobs/{job.id}/events'})
+        from core.video.pipeline.pipeline import VideoOpenError
+        try:
+            return jsonify(process_video(mode, conf, src_path, save_path, sample_fps=sample_fps, parallel=parallel,
+                                         track_path=track_path))
+        except VideoOpenError as e:
+            return jsonify({'status': 0,
+                            'error': str(e)})
 
     return jsonify({'status': 0, 'error': 'File type not allowed'})
 
 
+@app.route("/jobs", methods=['GET'])
+def list_jobs():
+    jobs = [job.to_dict() for job in job_manager.list()]
+    for result in gather_workers('/jobs'):
+        jobs.extend(result['jobs'])
+    return jsonify({'status': 1,
+                    'jobs': jobs})
+
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+@route_to_owner(lambda job_id: owner_of(job_id))
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'status': 0, 'error': 'Job not found'}), 404
+    return jsonify(dict(job.to_dict(), status=1))
+
+
+@app.route("/jobs/<job_id>/events", methods=['GET'])
+@route_to_owner(lambda job_id: owner_of(job_id))
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'status': 0, 'error': 'Job not found'}), 404
+    return Response(job.events(max_rate=app.config['JOB_EVENT_MAX_RATE']), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route("/jobs/<job_id>/cancel", methods=['POST'])
+@route_to_owner(lambda job_id: owner_of(job_id))
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'status': 0, 'error': 'Job not found'}), 404
+    return jsonify(dict(job.to_dict(), status=1))
+
+
 @app.route("/download", methods=['GET'])
 def download_file():
     # 需要知道2个参数, 第1个参数是本地目录的path, 第2个参数是文件名(带扩展名)
@@ -186,29 +582,155 @@ def download_file():
 def show_photo(file):
     if request.method == 'GET':
         if file is not None:
-            file_path = f'tmp/{file}'
-            if file.endswith('.jpg') or file.endswith('.jpeg'):
-                content_type = 'image/jpeg'
-            elif file.endswith('.png'):
-                content_type = 'image/png'
-            elif file.endswith('.mp4'):
-                content_type = 'video/mp4'
-            else:
+            content_type = MEDIA_TYPES.get(os.path.splitext(file)[1].lower())
+            if content_type is None:
                 return "Unsupported file format", 415  # Unsupported Media Type
 
-            if os.path.exists(file_path):
-                if content_type.startswith('image'):
-                    return send_file(file_path, mimetype=content_type)
-                elif content_type == 'video/mp4':
-                    return send_file(file_path, mimetype=content_type, as_attachment=True)
+            if os.path.exists(f'tmp/{file}'):
+                storage_manager.touch(f'tmp/{file}')
+                # conditional=True 由 werkzeug 处理 Range、ETag 与 Last-Modified，
+                # 文件按块流式发送，视频无需整段下载即可播放和拖动
+                return send_from_directory(os.path.abspath('tmp'), file, mimetype=content_type,
+                                           conditional=True, etag=True)
             else:
                 return "File not found", 404  # Not Found
 
     return "Invalid request", 400  # Bad Request
 
 
+@app.route('/mem/<key>', methods=['GET'])
+@route_to_owner(lambda key: owner_of(key))
+def show_memory_file(key):
+    item = memory_store.get(key)
+    if item is None:
+        return "File not found", 404  # Not Found
+    data, mimetype = item
+    return make_response(data, 200, {'Content-Type': mimetype})
+
+
+@app.route("/uploads", methods=['GET'])
+def list_uploads():
+    # 按时间倒序查询上传记录，可按识别模式过滤
+    query = Upload.query
+    mode = request.args.get('mode')
+    if mode:
+        query = query.filter(Upload.mode == mode)
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    offset = request.args.get('offset', 0, type=int)
+    uploads = query.order_by(Upload.created_at.desc()).offset(offset).limit(limit).all()
+    return jsonify([row_to_dict(upload) for upload in uploads])
+
+
+@app.route("/uploads/<upload_id>", methods=['GET'])
+def upload_detail(upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if upload is None:
+        return jsonify({'status': 0, 'message': 'upload not found'}), 404
+    data = row_to_dict(upload)
+    data['detections'] = [row_to_dict(row) for row in
+                          Detection.query.filter_by(upload_id=upload_id).order_by(Detection.seq)]
+    data['plates'] = [row_to_dict(row) for row in
+                      Plate.query.filter_by(upload_id=upload_id).order_by(Plate.track_id)]
+    return jsonify(data)
+
+
+def fetch_plates(last_id, limit):
+    with app.app_context():
+        rows = (db.session.query(Plate.id, Plate.plate, Plate.upload_id, Plate.track_id, Plate.time)
+                .filter(Plate.id > last_id).order_by(Plate.id).limit(limit).all())
+        return [tuple(row) for row in rows]
+
+
+def sync_plate_index(force=False):
+    # 检索前增量载入新写入的车牌，间隔内的重复请求直接使用现有索引
+    now = time.monotonic()
+    if force or now - plate_index_synced[0] >= app.config['PLATE_INDEX_SYNC_INTERVAL']:
+        plate_index_synced[0] = now
+        plate_index.sync(fetch_plates)
+
+
+@app.route("/plates/search", methods=['GET'])
+def search_plates():
+    # match=exact 精确，prefix 前缀（如 粤B），fuzzy 编辑距离不超过 max_distance
+    query = request.args.get('q', '').strip()
+    match = request.args.get('match', 'fuzzy')
+    limit = min(request.args.get('limit', 50, type=int), app.config['PLATE_SEARCH_MAX_RESULTS'])
+    if not query:
+        return jsonify({'status': 0, 'message': 'missing q'}), 400
+    sync_plate_index()
+    if match == 'exact':
+        matches = plate_index.exact(query)
+    elif match == 'prefix':
+        matches = plate_index.prefix(query, limit)
+    elif match == 'fuzzy':
+        max_distance = min(request.args.get('max_distance', 1, type=int), app.config['PLATE_SEARCH_MAX_DISTANCE'])
+        matches = plate_index.fuzzy(query, max_distance, limit)
+    else:
+        return jsonify({'status': 0, 'message': 'match must be exact, prefix or fuzzy'}), 400
+    results = []
+    for plate, distance in matches:
+        occurrences = [{'upload_id': upload_id, 'track_id': track_id, 'time': time_str}
+                       for upload_id, track_id, time_str in plate_index.occurrences(plate)]
+        results.append({'plate': plate,
+                        'distance': distance,
+                        'uploads': sorted({item['upload_id'] for item in occurrences}),
+                        'occurrences': occurrences})
+    return jsonify({'status': 1, 'query': query, 'match': match, 'results': results})
+
+
+@app.route("/db_stats", methods=['GET'])
+def db_stats():
+    return jsonify(dict(db_writer.stats(), plate_index=plate_index.stats()))
+
+
+@app.route("/models", methods=['GET'])
+def models():
+    return jsonify(model_registry.stats())
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    return make_response(metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+@app.route("/storage", methods=['GET'])
+def storage():
+    return jsonify(storage_manager.usage())
+
+
+@app.route("/cache_stats", methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+@app.route("/batch_stats", methods=['GET'])
+def batch_stats():
+    return jsonify(inference_batcher.stats())
+
+
+def camera_task(concatenated):
+    # 按前端选择返回 (检测函数, 位置参数, 采集源)，未知组合返回 None
+    from core.camera.camera import track_cam
+    from core.camera.screen_low import capture
+    from core.camera.modify import capture_and_detect
+    if concatenated == '000':
+        return track_cam, (0, os.path.join(app.config['MODEL_PATH'], 'code.pt')), 'camera:0'
+    elif concatenated == '001':
+        return track_cam, (0, os.path.join(app.config['MODEL_PATH'], 'car.pt')), 'camera:0'
+    elif concatenated == '010':
+        return track_cam, (1, os.path.join(app.config['MODEL_PATH'], 'code.pt')), 'camera:1'
+    elif concatenated == '011':
+        return track_cam, (1, os.path.join(app.config['MODEL_PATH'], 'car.pt')), 'camera:1'
+    elif re.match(r'10\d', concatenated):
+        return capture, (os.path.join(app.config['MODEL_PATH'], 'camera.pt'),), 'camera:1'
+    elif re.match(r'11\d', concatenated):
+        return capture_and_detect, (os.path.join(app.config['MODEL_PATH'], 'camera.pt'),), 'screen'
+    return None
+
 
 @app.route("/camera", methods=['POST'])
+@route_to_owner(camera_owner)
+@instrument('/camera')
 def camera():
     data = request.json
     if data:
@@ -216,35 +738,119 @@ def camera():
         key2 = data.get('key2', '')
         key3 = data.get('key3', '')
         concatenated = f"{key1}{key2}{key3}"
-        if concatenated == '000':
-            model_path = os.path.join(app.config['MODEL_PATH'], 'code.pt')
-            track_cam(0, model_path)
-            return "Processed successfully"
-        elif concatenated == '001':
-            model_path = os.path.join(app.config['MODEL_PATH'], 'car.pt')
-            track_cam(0, model_path)
-            return "Processed successfully"
-        elif concatenated == '010':
-            model_path = os.path.join(app.config['MODEL_PATH'], 'code.pt')
-            track_cam(1, model_path)
-            return "Processed successfully"
-        elif concatenated == '011':
-            model_path = os.path.join(app.config['MODEL_PATH'], 'car.pt')
-            track_cam(1, model_path)
-            return "Processed successfully"
-        elif re.match(r'10\d', concatenated):
-            model_path = os.path.join(app.config['MODEL_PATH'], 'camera.pt')
-            capture(model_path)
-            return "Processed successfully"
-        elif re.match(r'11\d', concatenated):
-            model_path = os.path.join(app.config['MODEL_PATH'], 'camera.pt')
-            capture_and_detect(model_path)
-            return "Processed successfully"
-        else:
+        task = camera_task(concatenated)
+        if task is None:
             return "fail"
+        func, args, source = task
+        if data.get('window'):
+            # 旧的本机窗口模式，阻塞到窗口中按下 q
+            func(*args)
+            return "Processed successfully"
+        # 每个会话在独立线程中运行并立即返回，同一权重文件的会话共享注册表中的模型，推理时逐帧加锁
+        try:
+            session = camera_sessions.start(concatenated, source, func, *args, model=model_registry.get(args[-1]))
+        except SourceBusy as e:
+            return jsonify({'status': 0, 'message': str(e)}), 409
+        return jsonify(dict(session.to_dict(), status=1))
     else:
         return "fail"
 
 
+@app.route("/camera/sessions", methods=['GET'])
+@route_to_owner(camera_owner)
+def camera_session_list():
+    return jsonify([session.to_dict() for session in camera_sessions.list()])
+
+
+@app.route("/camera/sessions/<session_id>", methods=['GET'])
+@route_to_owner(camera_owner)
+def camera_session_status(session_id):
+    session = camera_sessions.get(session_id)
+    if session is None:
+        return jsonify({'status': 0, 'message': 'session not found'}), 404
+    return jsonify(session.to_dict())
+
+
+@app.route("/camera/sessions/<session_id>/stream", methods=['GET'])
+@route_to_owner(camera_owner)
+def camera_session_stream(session_id):
+    session = camera_sessions.get(session_id)
+    if session is None:
+        return jsonify({'status': 0, 'message': 'session not found'}), 404
+    return Response(session.broadcaster.frames(), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@app.route("/camera/sessions/<session_id>/stop", methods=['POST'])
+@route_to_owner(camera_owner)
+def camera_session_stop(session_id):
+    session = camera_sessions.stop(session_id)
+    if session is None:
+        return jsonify({'status': 0, 'message': 'session not found'}), 404
+    return jsonify(session.to_dict())
+
+
+@app.route("/camera/stop", methods=['POST'])
+@route_to_owner(camera_owner)
+def camera_stop():
+    # 停止全部会话
+    return jsonify([session.to_dict() for session in camera_sessions.stop_all()])
+
+
+def preload_paths():
+    # 配置的预加载权重中实际存在的文件
+    paths = [os.path.join(app.config['MODEL_PATH'], name) for name in app.config['MODEL_PRELOAD']]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def preload_models():
+    model_registry.warmup_all(preload_paths())
+
+
+@app.route("/ready", methods=['GET'])
+def ready():
+    # 就绪检查：全部预加载模型预热完成前返回 503，编排系统据此决定是否转发流量
+    is_ready, models = model_registry.readiness(preload_paths())
+    missing = [name for name in app.config['MODEL_PRELOAD']
+               if not os.path.exists(os.path.join(app.config['MODEL_PATH'], name))]
+    return jsonify({'ready': is_ready, 'models': models, 'missing': missing}), 200 if is_ready else 503
+
+
+def preload():
+    # 启动时（多进程模式下在 fork 之前）载入权重与车牌索引，工作进程共享这部分内存
+    preload_models()
+    sync_plate_index(force=True)
+    # 载入时建立的数据库连接不带入工作进程
+    with app.app_context():
+        db.engine.dispose()
+
+
+def post_fork(index):
+    # 任务 id 与内存文件 key 带上本进程编号，其他进程据此转发请求
+    worker_state['index'] = index
+    job_manager.id_prefix = memory_store.id_prefix = f'w{index}_'
+    # 临时文件清理只需一个进程执行
+    if index == 0:
+        storage_manager.start()
+
+
 if __name__ == '__main__':
-    app.run()
+    parser = argparse.ArgumentParser(description='yolov8 flask server')
+    parser.add_argument('--workers', default=app.config['SERVER_WORKERS'], type=int,
+                        help='number of pre-forked worker processes, 1 runs the Flask dev server')
+    parser.add_argument('--torch-threads', default=app.config['TORCH_THREADS_PER_WORKER'], type=int,
+                        help='torch intra-op threads per worker')
+    parser.add_argument('--host', default=app.config['SERVER_HOST'])
+    parser.add_argument('--port', default=app.config['SERVER_PORT'], type=int)
+    args, _ = parser.parse_known_args()
+    if args.workers > 1:
+        from core.server.prefork import serve
+        worker_state['workers'] = args.workers
+        worker_state['port_base'] = app.config['SERVER_PRIVATE_PORT_BASE'] or args.port + 1
+        serve(app, host=args.host, port=args.port, workers=args.workers, torch_threads=args.torch_threads,
+              preload=preload, post_fork=post_fork, private_port_base=worker_state['port_base'])
+    else:
+        # 单进程模式下服务先启动，模型在后台线程中加载与预热，可通过 /ready 查看进度
+        threading.Thread(target=preload, name='warmup', daemon=True).start()
+        storage_manager.start()
+        app.run(host=args.host, port=args.port)
@@ -1,19 +1,32 @@
 from ultralytics import YOLO
 import cv2
-def track_cam(src, name):
-    model = YOLO(name)
+def track_cam(src, name, broadcaster=None, stop_event=None, model=None):
+    # broadcaster 不为空时以无窗口模式运行：结果帧推送给浏览器，直到 stop_event 被设置；
+    # model 为注册表中共享的模型时不再重复加载
+    if model is None:
+        model = YOLO(name)
     cap = cv2.VideoCapture(src)#src的值为0或1，0代表前置摄像头，1代表网络摄像头
-    cv2.namedWindow("aminos", cv2.WINDOW_AUTOSIZE)
+    if broadcaster is None:
+        cv2.namedWindow("aminos", cv2.WINDOW_AUTOSIZE)
 
     if not cap.isOpened():
         print("打不开摄像头")
+        if broadcaster is not None:
+            raise RuntimeError("打不开摄像头")
         exit()
     run = True
     while run:
         # 读取摄像头的一帧
         ret, frame = cap.read()
+        if not ret:
+            print("无法读取帧")
+            break
         image_det = cv2.resize(frame, (640, 640))
         result = model.predict(source=image_det, conf=0.6, save=False)
+        if broadcaster is not None:
+            broadcaster.publish(result[0].plot())
+            run = not stop_event.is_set()
+            continue
         # 显示帧
         cv2.imshow("摄像头", result[0].plot())
         # 按下 'q' 键退出
@@ -21,5 +34,6 @@ def track_cam(src, name):
             run = False
     # 释放摄像头并关闭所有窗口
     cap.release()
-    cv2.destroyAllWindows()
+    if broadcaster is None:
+        cv2.destroyAllWindows()
     return
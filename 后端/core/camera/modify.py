@@ -3,11 +3,15 @@ import numpy as np
 import cv2
 import torch
 import mss
-def capture_and_detect(m_name):
-    model = YOLO(m_name)
-    device = torch.device("cuda:0")
-    model.to(device)
-    cv2.namedWindow("aminos", cv2.WINDOW_AUTOSIZE)
+def capture_and_detect(m_name, broadcaster=None, stop_event=None, model=None):
+    # broadcaster 不为空时以无窗口模式运行：结果帧推送给浏览器，直到 stop_event 被设置；
+    # model 为注册表中共享的模型时不再重复加载
+    if model is None:
+        model = YOLO(m_name)
+        device = torch.device("cuda:0")
+        model.to(device)
+    if broadcaster is None:
+        cv2.namedWindow("aminos", cv2.WINDOW_AUTOSIZE)
     # 初始化 Tkinter 主窗口
     monitor = {"top": 0, "left": 0, "width": 900, "height": 1000}
     isRun=True
@@ -16,10 +20,15 @@ def capture_and_detect(m_name):
             screenshot = sct.grab(monitor)
             image_src = cv2.cvtColor(np.array(screenshot), cv2.COLOR_BGRA2BGR)
             result = model.predict(source=image_src, conf=0.7, save=False)
+            if broadcaster is not None:
+                broadcaster.publish(result[0].plot(line_width=1))
+                isRun = not stop_event.is_set()
+                continue
             cv2.imshow("aminos", result[0].plot(line_width=1))
             if cv2.waitKey(1) == ord('q'):  # 按 q 退出
                 isRun=False
-    cv2.destroyWindow("aminos",)
+    if broadcaster is None:
+        cv2.destroyWindow("aminos",)
 if __name__ == "__main__":
     name = "7171551.pt"
     capture_and_detect(name)
\ No newline at end of file
@@ -4,15 +4,19 @@ import cv2
 import torch
 import threading
 
-def capture(name):
-    model = YOLO(name)
-    device = torch.device("cuda:0")
-    model.to(device)
+def capture(name, broadcaster=None, stop_event=None, model=None):
+    # broadcaster 不为空时以无窗口模式运行：结果帧推送给浏览器，直到 stop_event 被设置；
+    # model 为注册表中共享的模型时不再重复加载
+    if model is None:
+        model = YOLO(name)
+        device = torch.device("cuda:0")
+        model.to(device)
     cap = cv2.VideoCapture(1)
     # 设置期望的捕获分辨率（例如 1920x1080）
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
-    cv2.namedWindow("aminos", cv2.WINDOW_AUTOSIZE)
+    if broadcaster is None:
+        cv2.namedWindow("aminos", cv2.WINDOW_AUTOSIZE)
     while True:
         ret, frame = cap.read()
         if not ret:
@@ -29,11 +33,18 @@ def capture(name):
         box_class_pairs = list(zip(boxes, classes))  # 边界框与类名自然连接
         draw_boxes(image_src, box_class_pairs, size_x, size_y)
         display_frame = cv2.resize(image_src, (630, 630))
+        if broadcaster is not None:
+            broadcaster.publish(display_frame)
+            if stop_event.is_set():
+                break
+            continue
         cv2.imshow("aminos",  display_frame)
         # 按下 'q' 键退出
         if cv2.waitKey(1) == ord('q'):
             break
-    cv2.destroyAllWindows()
+    cap.release()
+    if broadcaster is None:
+        cv2.destroyAllWindows()
 def draw_boxes(image_src, box_class_pairs, size_x, size_y):
     clsdict = {
         0: {"color": (255, 255, 255), "text": ""},
@@ -0,0 +1,112 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from core.camera.stream import FrameBroadcaster
+
+
+class SourceBusy(Exception):
+    pass
+
+
+class CameraSession(object):
+    # 一个实时检测会话：在独立线程中运行采集与推理循环，结果帧通过 broadcaster 推送，
+    # 状态依次为 running -> stopped / finished / failed
+    def __init__(self, session_id, mode, source, func, args, kwargs, quality=80):
+        self.id = session_id
+        self.mode = mode
+        self.source = source
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.broadcaster = FrameBroadcaster(quality=quality)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.state = 'running'
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def finished(self):
+        return self.state in ('stopped', 'finished', 'failed')
+
+    def to_dict(self):
+        return {'session_id': self.id,
+                'mode': self.mode,
+                'source': self.source,
+                'state': self.state,
+                'frames': self.broadcaster.seq,
+                'error': self.error,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'stream_url': f'/camera/sessions/{self.id}/stream'}
+
+
+class SessionManager(object):
+    # 管理多个并发的实时检测会话，同一采集源（摄像头编号或屏幕）同时只允许一个会话使用
+    def __init__(self, max_sessions=4, max_history=20, quality=80):
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def start(self, mode, source, func, *args, **kwargs):
+        session = CameraSession(uuid.uuid4().hex, mode, source, func, args, kwargs, quality=self.quality)
+        with self.lock:
+            active = [s for s in self.sessions.values() if not s.finished()]
+            for other in active:
+                if other.source == source:
+                    raise SourceBusy(f'{source} 正在被会话 {other.id} 使用')
+            if len(active) >= self.max_sessions:
+                raise SourceBusy(f'同时运行的会话数已达上限 {self.max_sessions}')
+            self.sessions[session.id] = session
+            self.trim_history()
+        session.thread = threading.Thread(target=self.run, args=(session,), name='camera-' + session.id[:8],
+                                          daemon=True)
+        session.thread.start()
+        return session
+
+    def run(self, session):
+        try:
+            session.func(*session.args, broadcaster=session.broadcaster, stop_event=session.stop_event,
+                         **session.kwargs)
+            session.state = 'stopped' if session.stop_event.is_set() else 'finished'
+        except Exception as e:
+            print("实时检测会话失败:" + session.id, e)
+            session.error = str(e)
+            session.state = 'failed'
+        finally:
+            session.finished_at = time.time()
+            session.broadcaster.close()
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def stop(self, session_id, timeout=5):
+        session = self.get(session_id)
+        if session is None:
+            return None
+        session.stop_event.set()
+        session.thread.join(timeout=timeout)
+        return session
+
+    def stop_all(self, timeout=5):
+        sessions = [s for s in self.list() if not s.finished()]
+        for session in sessions:
+            session.stop_event.set()
+        for session in sessions:
+            session.thread.join(timeout=timeout)
+        return sessions
+
+    def trim_history(self):
+        # 调用方需持有 self.lock；只淘汰已结束的最早会话
+        finished = [session_id for session_id, s in self.sessions.items() if s.finished()]
+        while len(self.sessions) > self.max_history and finished:
+            del self.sessions[finished.pop(0)]
@@ -0,0 +1,48 @@
+import threading
+
+import cv2
+
+
+class FrameBroadcaster(object):
+    # 摄像头结果帧的广播器：每帧只做一次 JPEG 编码，只保留最新一帧；
+    # 观看者各自等待新帧，处理慢的观看者直接跳过中间帧，不会拖慢采集与推理循环
+    def __init__(self, quality=80):
+        self.quality = quality
+        self.frame = None
+        self.seq = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def publish(self, frame):
+        ok, buf = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+        if not ok:
+            return
+        with self.cond:
+            self.frame = buf.tobytes()
+            self.seq += 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def wait(self, last_seq, timeout=None):
+        # 阻塞到出现比 last_seq 更新的帧，返回 (seq, jpeg)；广播结束时返回 (seq, None)
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > last_seq or self.closed, timeout)
+            if self.seq > last_seq:
+                return self.seq, self.frame
+            return self.seq, None
+
+    def frames(self, timeout=10):
+        # multipart/x-mixed-replace 格式的 MJPEG 数据流
+        seq = 0
+        while True:
+            seq, frame = self.wait(seq, timeout)
+            if frame is None:
+                if self.closed:
+                    return
+                continue
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(frame)).encode() +
+                   b'\r\n\r\n' + frame + b'\r\n')
@@ -1,3 +1,6 @@
+import os
+
+
 class BaseConfig(object):
     # 数据库的配置
     DIALCT = "mysql"
@@ -8,5 +11,98 @@ class BaseConfig(object):
     PASSWORD = "xpq041017"
     DBNAME = 'yolov8_flask'
 
-    SQLALCHEMY_DATABASE_URI = f"{DIALCT}+{DRITVER}://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?charset=utf8"
+    # 可通过环境变量 DATABASE_URL 指定其他数据库，例如 sqlite:///yolov8_flask.db
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', f"{DIALCT}+{DRITVER}://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?charset=utf8")
     SQLALCHEMY_TRACK_MODIFICATIONS = True
+    # 上面的数据库连不上时改用的本地数据库，None 表示不回退
+    SQLALCHEMY_FALLBACK_URI = 'sqlite:///yolov8_flask.db'
+    # 识别结果批量写入：每批最多条数、最长攒批时间（秒）、队列上限
+    DB_WRITE_BATCH_SIZE = 200
+    DB_WRITE_INTERVAL = 1.0
+    DB_WRITE_QUEUE_MAX = 10000
+    # 车牌检索：允许的最大编辑距离、单次返回条数上限、检索前与数据库增量同步的最短间隔（秒）
+    PLATE_SEARCH_MAX_DISTANCE = 2
+    PLATE_SEARCH_MAX_RESULTS = 200
+    PLATE_INDEX_SYNC_INTERVAL = 1.0
+
+    # 大图切片推理（/upload 传 tile=1 启用）：切片边长与重叠比例、是否跳过灰度标准差低于阈值的空白切片、
+    # 跨切片 NMS 的重叠阈值（交集 / 较小框面积）、是否附带整图缩小后的一次推理、单次前向的切片数
+    TILE_SIZE = 640
+    TILE_OVERLAP = 0.2
+    TILE_SKIP_EMPTY = True
+    TILE_MIN_STD = 8.0
+    TILE_NMS_THRESHOLD = 0.5
+    TILE_INCLUDE_FULL = True
+    TILE_BATCH_SIZE = 16
+
+    # 验证码视频的时间窗口投票：窗口帧数、至少需要的有效帧数、每个字符位置的最低加权得票占比
+    VIDEO_VOTE_WINDOW = 5
+    VIDEO_VOTE_MIN_VOTES = 3
+    VIDEO_VOTE_MIN_AGREEMENT = 0.6
+    # 视频处理：流水线各级队列长度、单次批量前向的帧数
+    VIDEO_QUEUE_SIZE = 8
+    VIDEO_BATCH_SIZE = 4
+    # 验证码视频（mode=code）的场景变化门控：缩小灰度图与上次推理帧的平均绝对差低于该值时沿用上次结果，
+    # 0 表示关闭；其他模式始终逐个采样帧推理
+    VIDEO_SCENE_THRESHOLD = 2.0
+    # 视频默认分析帧率，0 表示逐帧分析；上传时可用 sample_fps 覆盖
+    VIDEO_SAMPLE_FPS = 0
+    # 视频默认输出：video 为重新编码的标注视频，track 只输出检测轨迹边车文件（.jsonl，前端在原视频上绘制），
+    # both 两者都输出；上传时可用 output 覆盖
+    VIDEO_OUTPUT = 'video'
+    # 标注视频的编码器（fourcc）与质量（0-100，None 为编码器默认，只有部分编码器支持）
+    VIDEO_FOURCC = 'VP90'
+    VIDEO_QUALITY = None
+    # 验证码视频分段并行（上传时 parallel=1）：工作进程数与每段最短时长（秒），短视频不切分
+    VIDEO_SEGMENT_WORKERS = max(2, os.cpu_count() or 1)
+    VIDEO_SEGMENT_MIN_SECONDS = 10
+
+    # 模型缓存的内存预算（字节），超出后按最近最少使用淘汰，None 表示不限制
+    MODEL_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+    # 启动时预加载的权重文件
+    MODEL_PRELOAD = ['code.pt', 'car.pt', 'yolo.pt', 'video.pt', 'lprnet_best.pth']
+
+    # 图片推理微批处理：单批最大图片数与最长等待时间（毫秒），BATCH_MAX_SIZE 为 1 时不合批
+    BATCH_MAX_SIZE = 8
+    BATCH_MAX_WAIT_MS = 5
+
+    # 视频后台任务：工作线程数、各权重文件的并发上限与保留的历史任务数
+    JOB_MAX_WORKERS = 2
+    JOB_MODEL_LIMITS = {'video.pt': 1}
+    JOB_DEFAULT_MODEL_LIMIT = 1
+    JOB_MAX_HISTORY = 100
+    # 任务进度事件流每秒最多推送的次数
+    JOB_EVENT_MAX_RATE = 5
+
+    # 图片结果的默认落盘方式：sync 同步写入，async 后台写入，none 仅保存在内存中
+    UPLOAD_PERSIST_MODE = 'sync'
+    # 内存结果的有效期（秒）与最大条数
+    MEMORY_STORE_TTL = 60
+    MEMORY_STORE_MAX_ITEMS = 256
+
+    # 识别结果缓存：最大字节数与有效期（秒）
+    RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    RESULT_CACHE_TTL = 600
+
+    # 临时文件容量管理：总字节预算、最长保存时间（秒）与后台清理间隔（秒）
+    STORAGE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    STORAGE_MAX_AGE = 24 * 60 * 60
+    STORAGE_SWEEP_INTERVAL = 60
+
+    # 服务启动配置：SERVER_WORKERS 大于 1 时父进程预加载权重后 fork 出多个工作进程，
+    # 每个工作进程使用 TORCH_THREADS_PER_WORKER 个 torch 线程（None 表示按 CPU 核数平分）；
+    # 后台任务与 /mem 结果保存在创建它的工作进程内，id 带有进程编号，其他进程收到请求时
+    # 转发到该进程的内部端口 SERVER_PRIVATE_PORT_BASE + 编号（None 表示 SERVER_PORT + 1 起），
+    # 摄像头会话统一由 0 号工作进程管理
+    SERVER_HOST = '127.0.0.1'
+    SERVER_PORT = 5000
+    SERVER_WORKERS = 1
+    TORCH_THREADS_PER_WORKER = None
+    SERVER_PRIVATE_PORT_BASE = None
+
+    # 摄像头/屏幕实时检测：推流 JPEG 质量、同时运行的会话数上限、保留的已结束会话数；
+    # 多进程模式下会话由 0 号工作进程创建和保存，其他进程收到的会话请求（含推流）转发给它
+    CAMERA_JPEG_QUALITY = 80
+    CAMERA_MAX_SESSIONS = 4
+    CAMERA_MAX_HISTORY = 20
@@ -0,0 +1,152 @@
+import datetime
+import os
+import queue
+import threading
+import time
+
+import sqlalchemy
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+
+class Upload(db.Model):
+    # 一次图片或视频上传，id 与保存的文件名一致
+    __tablename__ = 'uploads'
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(8), nullable=False)
+    mode = db.Column(db.String(16), nullable=False, index=True)
+    conf = db.Column(db.Float)
+    src_path = db.Column(db.String(255))
+    save_path = db.Column(db.String(255))
+    result_count = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class Detection(db.Model):
+    # 识别出的字符串：图片为一条，验证码视频为每段识别结果，time 为视频内时间
+    __tablename__ = 'detections'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    upload_id = db.Column(db.String(32), db.ForeignKey('uploads.id'), nullable=False, index=True)
+    mode = db.Column(db.String(16), nullable=False)
+    seq = db.Column(db.Integer)
+    text = db.Column(db.String(255))
+    time = db.Column(db.String(16))
+    created_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (db.Index('ix_detections_mode_created_at', 'mode', 'created_at'),)
+
+
+class Plate(db.Model):
+    # 车牌视频中每个跟踪目标的识别结果
+    __tablename__ = 'plates'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    upload_id = db.Column(db.String(32), db.ForeignKey('uploads.id'), nullable=False, index=True)
+    track_id = db.Column(db.Integer)
+    plate = db.Column(db.String(32), index=True)
+    time = db.Column(db.String(16))
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+def row_to_dict(row):
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns}
+
+
+def init_db(app, fallback_uri=None):
+    # 配置的数据库不可用时（如本地没有 MySQL）改用 fallback_uri，通常为 SQLite
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if fallback_uri and uri != fallback_uri:
+        try:
+            engine = sqlalchemy.create_engine(uri)
+            engine.connect().close()
+            engine.dispose()
+        except Exception as e:
+            print("数据库连接失败，改用:" + fallback_uri, e)
+            app.config['SQLALCHEMY_DATABASE_URI'] = fallback_uri
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        # 建表用的连接不带入 fork 出的工作进程
+        db.engine.dispose()
+
+
+class DbWriter(object):
+    # 识别结果的缓冲写入：请求线程只把记录放入队列，后台线程攒批后按表批量插入，
+    # 不占用推理请求的耗时；队列满时丢弃记录并计数
+    def __init__(self, app, batch_size=200, interval=1.0, max_queue=10000):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def submit(self, model, **values):
+        # 后台线程在首次写入时启动，fork 出的子进程各自启动自己的线程
+        self.start()
+        values.setdefault('created_at', datetime.datetime.now())
+        try:
+            self.queue.put_nowait((model, values))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        # 按模型分组，父表在前，保证外键先写入
+        rows = {Upload: [], Detection: [], Plate: []}
+        for model, values in batch:
+            rows[model].append(values)
+        try:
+            with self.app.app_context():
+                for model, values in rows.items():
+                    if values:
+                        db.session.execute(sqlalchemy.insert(model), values)
+                db.session.commit()
+            self.written += len(batch)
+        except Exception as e:
+            print("批量写入数据库失败，改为逐条写入:", e)
+            self.flush_rows(rows)
+
+    def flush_rows(self, rows):
+        # 逐条插入并提交，一条记录违反约束时只丢弃这一条，不影响同批其他请求的记录
+        with self.app.app_context():
+            db.session.rollback()
+            for model, values in rows.items():
+                for row in values:
+                    try:
+                        db.session.execute(sqlalchemy.insert(model), [row])
+                        db.session.commit()
+                        self.written += 1
+                    except Exception as e:
+                        db.session.rollback()
+                        print("写入数据库失败:", e)
+                        self.failed += 1
+
+    def stats(self):
+        return {'queued': self.queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed}
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import Counter
+
+from core.metrics.metrics import stage_timer
+
+
+class InferenceBatcher(object):
+    # 动态微批处理调度器：同一模型的并发请求在 max_wait_ms 内或凑满 max_batch_size 张后
+    # 合并为一次批量前向，再把各自的结果分发回调用方
+    def __init__(self, get_model, max_batch_size=8, max_wait_ms=5):
+        self.get_model = get_model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self.cond = threading.Condition()
+        # 每个模型当前仍在接收请求的批次
+        self.pending = {}
+        # 批大小分布统计
+        self.batch_sizes = Counter()
+
+    def predict(self, model_path, image, conf):
+        request = {'image': image, 'conf': conf, 'event': threading.Event(), 'result': None, 'error': None}
+        with self.cond:
+            batch = self.pending.get(model_path)
+            leader = batch is None
+            if leader:
+                batch = self.pending[model_path] = []
+            batch.append(request)
+            # 批次已满，立即关闭，下一个请求将开启新批次
+            if len(batch) >= self.max_batch_size:
+                del self.pending[model_path]
+                self.cond.notify_all()
+
+        # 批次中第一个请求负责等待凑批并执行推理
+        if leader:
+            deadline = time.monotonic() + self.max_wait
+            with self.cond:
+                while self.pending.get(model_path) is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self.pending[model_path]
+                        break
+                    self.cond.wait(remaining)
+            self.run_batch(model_path, batch)
+
+        request['event'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def run_batch(self, model_path, batch):
+        try:
+            model = self.get_model(model_path)
+            # 以批内最低置信度推理，再按各请求自己的阈值过滤
+            min_conf = min(request['conf'] for request in batch)
+            with stage_timer('yolo_inference'):
+                results = model([request['image'] for request in batch], conf=min_conf)
+            for request, r in zip(batch, results):
+                if request['conf'] > min_conf:
+                    r = r[r.boxes.conf >= request['conf']]
+                request['result'] = r
+        except Exception as e:
+            for request in batch:
+                request['error'] = e
+        finally:
+            with self.cond:
+                self.batch_sizes[len(batch)] += 1
+            for request in batch:
+                request['event'].set()
+
+    def stats(self):
+        with self.cond:
+            batches = sum(self.batch_sizes.values())
+            images = sum(size * count for size, count in self.batch_sizes.items())
+            return {'max_batch_size': self.max_batch_size,
+                    'max_wait_ms': self.max_wait * 1000,
+                    'batches': batches,
+                    'images': images,
+                    'mean_batch_size': images / batches if batches else 0,
+                    'batch_sizes': {str(size): count for size, count in sorted(self.batch_sizes.items())}}
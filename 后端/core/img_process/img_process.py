@@ -1,72 +1,113 @@
 from ultralytics import YOLO
-from PIL import Image
+import numpy as np
 import cv2
 
+from core.metrics.metrics import observe, stage_timer
+from core.render.render import draw_detections
 
-def plot_bboxes(image, boxes, names, colors, line_thickness=None):
-    tl = line_thickness or round(0.002 * (image.shape[0] + image.shape[1]) / 2) + 1  # 线条/字体粗细
-    detected_classes = []  # 初始化识别结果的列表
+# OpenCV 可直接编码的结果图格式
+ENCODE_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.bmp': 'image/bmp',
+                '.webp': 'image/webp'}
 
-    for box in boxes:
-        x1, y1, x2, y2 = map(int, box.xyxy[0])  # 提取边界框坐标并转换为整数
-        cls_id = int(box.cls[0])  # 提取类别ID
-        conf = box.conf[0]  # 提取置信度分数
 
-        if cls_id >= len(names):
-            print(f"无效的类别ID {cls_id}，超出了名称列表的范围")
-            continue
+@observe('decode')
+def decode_image(data):
+    # 直接从内存缓冲区解码上传的图片，避免先落盘再读取
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
 
-        color = colors[cls_id]
-        c1, c2 = (x1, y1), (x2, y2)
-        cv2.rectangle(image, c1, c2, color, thickness=tl, lineType=cv2.LINE_AA)
-        tf = max(tl - 1, 1)  # 字体粗细
-        label = f'{names[cls_id]} {conf:.2f}'
-        t_size = cv2.getTextSize(label, 0, fontScale=tl / 3, thickness=tf)[0]
-        c2 = c1[0] + t_size[0], c1[1] - t_size[1] - 3
 
-        # 添加文本背景矩形
-        text_bg_color = (0, 0, 0)  # 黑色背景
-        cv2.rectangle(image, c1, c2, text_bg_color, -1, cv2.LINE_AA)  # 填充
-        cv2.putText(image, label, (c1[0], c1[1] - 2), 0, tl / 3, [225, 255, 255], thickness=tf, lineType=cv2.LINE_AA)
+@observe('encode_write')
+def encode_image(im_array, ext='.jpg'):
+    # 返回 (编码数据, 实际扩展名, MIME 类型)，扩展名与上传文件可能不同
+    ext, mime_type = encode_format(ext)
+    _, buf = cv2.imencode(ext, im_array)
+    return buf.tobytes(), ext, mime_type
 
-        # 收集识别结果，附带边界框左上角的x坐标
-        detected_classes.append((x1, names[cls_id]))
 
-    # 根据x坐标对识别结果进行排序，输出预测结果
-    detected_classes.sort(key=lambda x: x[0])
-    detected_classes_str = ''.join([cls[1] for cls in detected_classes])
+def encode_format(ext):
+    # 结果图实际使用的格式：OpenCV 无法编码的格式（如 gif）统一编码为 png
+    ext = ext.lower()
+    if ext not in ENCODE_TYPES:
+        ext = '.png'
+    return ext, ENCODE_TYPES[ext]
 
-    return image, detected_classes_str
-
-
-def img_process(conf, model_path, image_path, save_path):
-    # 加载模型
-    model = YOLO(model_path)
-    # 加载图像
-    orig_img = cv2.imread(image_path)
 
+@observe('resize')
+def resize_image(orig_img, new_width=640):
     # 计算新的尺寸，同时保持纵横比
     height, width = orig_img.shape[:2]
-    new_width = 640
     scale_ratio = new_width / width
     new_height = int(height * scale_ratio)
 
     # 在保持纵横比的同时调整图像大小
-    resized_img = cv2.resize(orig_img, (new_width, new_height))
+    return cv2.resize(orig_img, (new_width, new_height))
+
+
+def predict_image(conf, model_path, orig_img, model=None, batcher=None, tile=None):
+    # 加载模型，优先使用调用方传入的已加载模型；使用批处理调度器时由调度器取模型
+    if model is None and batcher is None:
+        model = YOLO(model_path)
+
+    # 切片模式：tile 为 predict_tiled 的参数，原图分辨率推理，切片自成一批，不经过调度器
+    if tile is not None:
+        from core.img_process.tiling import predict_tiled
+        if model is None:
+            model = batcher.get_model(model_path)
+        r, _ = predict_tiled(model, orig_img, conf, **tile)
+        return r, 1.0
+
+    resized_img = resize_image(orig_img)
+    scale = resized_img.shape[1] / orig_img.shape[1]
 
-    # 执行推理
-    results = model(resized_img, conf=conf)
+    # 执行推理，并发请求由调度器合并为一次批量前向
+    if batcher is not None:
+        r = batcher.predict(model_path, resized_img, conf)
+    else:
+        with stage_timer('yolo_inference'):
+            results = model(resized_img, conf=conf)
+        results = list(results)
+        r = results[0]
+    return r, scale
 
-    results = list(results)
-    r = results[0]
+
+def render_result(r):
     boxes = r.boxes
     names = r.names
     # 生成颜色列表，长度与类别数量一致
     colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)] * (len(names) // 3 + 1)
     colors = colors[:len(names)]
     im_array = r.orig_img.copy()
-    im_array, detected_classes_str = plot_bboxes(im_array, boxes, names, colors)
+    return draw_detections(im_array, boxes, names, colors)
+
+
+def detect_image(conf, model_path, orig_img, model=None, batcher=None, tile=None):
+    r, _ = predict_image(conf, model_path, orig_img, model=model, batcher=batcher, tile=tile)
+    return render_result(r)
 
-    im = Image.fromarray(cv2.cvtColor(im_array, cv2.COLOR_BGR2RGB))  # 确保颜色空间转换正确
-    im.save(save_path)  # 保存图像
+
+@observe('postprocess')
+def extract_detections(r, scale=1.0):
+    # 结构化结果：一次性把 r.boxes.data 拷回内存（x1, y1, x2, y2, [track_id,] conf, cls），
+    # 坐标换算回原图尺寸；text 与 draw_detections 的识别字符串一致
+    data = r.boxes.data.cpu().numpy()
+    names = r.names
+    boxes = data[:, :4].astype(float) / scale
+    scores = data[:, -2].astype(float)
+    classes = data[:, -1].astype(int)
+    order = sorted((int(x1), i) for i, x1 in enumerate(data[:, 0]) if classes[i] < len(names))
+    return {'boxes': np.round(boxes, 1).tolist(),
+            'scores': np.round(scores, 4).tolist(),
+            'classes': classes.tolist(),
+            'names': {int(c): names[c] for c in set(classes.tolist()) if c < len(names)},
+            'text': ''.join(names[classes[i]] for _, i in order)}
+
+
+def img_process(conf, model_path, image_path, save_path, model=None, batcher=None, tile=None):
+    # 加载图像
+    with stage_timer('decode'):
+        orig_img = cv2.imread(image_path)
+    im_array, detected_classes_str = detect_image(conf, model_path, orig_img, model=model, batcher=batcher, tile=tile)
+    # 直接以 BGR 写出，无需经 PIL 转换颜色空间
+    with stage_timer('encode_write'):
+        cv2.imwrite(save_path, im_array)  # 保存图像
     return detected_classes_str
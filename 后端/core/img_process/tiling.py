@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+import torch
+
+from core.metrics.metrics import observe, stage_timer
+
+
+def make_tiles(height, width, tile_size=640, overlap=0.2):
+    # 按步长 tile_size * (1 - overlap) 切分，最后一行/列贴齐图像边缘
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def has_foreground(tile, min_std=8.0):
+    # 缩小后灰度标准差过低（纯色、空白背景）的切片视为没有前景
+    small = cv2.resize(tile, (32, 32), interpolation=cv2.INTER_AREA)
+    return float(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).std()) >= min_std
+
+
+def nms(data, threshold=0.5):
+    # 跨切片的按类别贪心 NMS：data 为 (N, 6) 的 x1, y1, x2, y2, conf, cls；
+    # 重叠度用交集 / 较小框面积，切片边缘被截断的半个框也能与完整框合并；
+    # 合并时保留最高置信度与类别，坐标取被合并框中面积最大的一个（截断的半个框置信度可能更高）
+    if len(data) == 0:
+        return data
+    order = np.argsort(-data[:, 4])
+    data = data[order]
+    areas = (data[:, 2] - data[:, 0]) * (data[:, 3] - data[:, 1])
+    keep = []
+    suppressed = np.zeros(len(data), bool)
+    for i in range(len(data)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        rest = np.arange(i + 1, len(data))
+        rest = rest[~suppressed[rest] & (data[rest, 5] == data[i, 5])]
+        if len(rest) == 0:
+            continue
+        w = np.clip(np.minimum(data[i, 2], data[rest, 2]) - np.maximum(data[i, 0], data[rest, 0]), 0, None)
+        h = np.clip(np.minimum(data[i, 3], data[rest, 3]) - np.maximum(data[i, 1], data[rest, 1]), 0, None)
+        overlap = w * h / np.maximum(np.minimum(areas[i], areas[rest]), 1e-6)
+        duplicates = rest[overlap > threshold]
+        if len(duplicates) == 0:
+            continue
+        suppressed[duplicates] = True
+        largest = duplicates[np.argmax(areas[duplicates])]
+        if areas[largest] > areas[i]:
+            data[i, :4] = data[largest, :4]
+            areas[i] = areas[largest]
+    return data[keep]
+
+
+@observe('tiled_inference')
+def predict_tiled(model, orig_img, conf, tile_size=640, overlap=0.2, skip_empty=True, min_std=8.0,
+                  nms_threshold=0.5, include_full=True, batch_size=16):
+    # 切片推理：重叠切片（可附带整图缩小后的一张）合成批次前向，坐标平移回原图后做跨切片 NMS，
+    # 返回原图尺寸上的 Results，可直接交给 render_result / extract_detections
+    from ultralytics.engine.results import Results
+
+    height, width = orig_img.shape[:2]
+    images, offsets = [], []
+    for x0, y0, x1, y1 in make_tiles(height, width, tile_size, overlap):
+        tile = orig_img[y0:y1, x0:x1]
+        if skip_empty and not has_foreground(tile, min_std):
+            continue
+        images.append(tile)
+        offsets.append((x0, y0, 1.0))
+    # 所有切片都被跳过时（如不大于 tile_size、前景对比度低的图片）仍推理整图，不直接返回空结果
+    if not images or (include_full and (height > tile_size or width > tile_size)):
+        scale = min(1.0, tile_size / max(height, width))
+        images.append(orig_img if scale == 1.0 else cv2.resize(orig_img, (int(width * scale), int(height * scale))))
+        offsets.append((0, 0, scale))
+
+    merged = []
+    names = model.names
+    with stage_timer('yolo_inference'):
+        for start in range(0, len(images), batch_size):
+            results = model(images[start:start + batch_size], conf=conf, verbose=False)
+            for r, (x0, y0, scale) in zip(results, offsets[start:start + batch_size]):
+                data = r.boxes.data.cpu().numpy()
+                if len(data) == 0:
+                    continue
+                data = np.concatenate([data[:, :4], data[:, -2:]], axis=1)
+                data[:, :4] /= scale
+                data[:, [0, 2]] += x0
+                data[:, [1, 3]] += y0
+                merged.append(data)
+    data = nms(np.concatenate(merged), nms_threshold) if merged else np.zeros((0, 6), np.float32)
+    return Results(orig_img, path='', names=names, boxes=torch.from_numpy(data.astype(np.float32))), len(images)
@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job(object):
+    # 后台视频处理任务，状态依次为 queued -> running -> done / failed / cancelled
+    def __init__(self, job_id, model_key, func, kwargs, snapshot_interval=0.2):
+        self.id = job_id
+        self.model_key = model_key
+        self.func = func
+        self.kwargs = kwargs
+        self.state = 'queued'
+        self.frames_done = 0
+        self.total_frames = 0
+        self.result_info = []
+        self.result_count = None
+        # 识别结果快照的最短间隔（秒），处理函数逐帧回调时不必每帧复制/汇总结果列表
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_at = 0.0
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        # 每次状态变化递增 version 并唤醒事件流
+        self.version = 0
+        self.cond = threading.Condition()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def progress(self, frames_done, total_frames, result_info, result_count=None):
+        # 由处理函数逐帧回调；任务被取消时抛出 JobCancelled 中断处理。
+        # result_info 为处理函数内部的结果列表，或返回结果列表的函数（需要汇总时），
+        # 在处理线程中至多每 snapshot_interval 秒复制/汇总一次
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.frames_done = frames_done
+        self.total_frames = total_frames
+        self.result_count = result_count
+        now = time.monotonic()
+        if now - self.snapshot_at >= self.snapshot_interval:
+            self.snapshot_at = now
+            self.result_info = list(result_info() if callable(result_info) else result_info)
+        self.notify()
+
+    def notify(self):
+        with self.cond:
+            self.version += 1
+            self.cond.notify_all()
+
+    def events(self, max_rate=5, keepalive=15):
+        # Server-Sent Events 流：逐帧进度被合并，每秒最多推送 max_rate 次；
+        # 只推送新增的识别结果，任务结束时推送完整结果后关闭
+        sent_version = -1
+        sent_items = 0
+        while True:
+            with self.cond:
+                if not self.cond.wait_for(lambda: self.version != sent_version, timeout=keepalive):
+                    yield ': keepalive\n\n'
+                    continue
+                sent_version = self.version
+            if self.finished():
+                yield f'event: {self.state}\ndata: {json.dumps(self.to_dict(), ensure_ascii=False)}\n\n'
+                return
+            result_info = self.result_info
+            data = {'job_id': self.id,
+                    'state': self.state,
+                    'frames_done': self.frames_done,
+                    'total_frames': self.total_frames,
+                    'progress': self.frames_done / self.total_frames if self.total_frames else 0,
+                    'result_count': self.result_count,
+                    'new_results': result_info[sent_items:]}
+            sent_items = max(sent_items, len(result_info))
+            yield f'event: progress\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+            time.sleep(1.0 / max_rate)
+
+    def finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return {'job_id': self.id,
+                'model': self.model_key,
+                'state': self.state,
+                'frames_done': self.frames_done,
+                'total_frames': self.total_frames,
+                'progress': self.frames_done / self.total_frames if self.total_frames else 0,
+                'result_info': self.result_info,
+                'result_count': self.result_count,
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at}
+
+
+class JobManager(object):
+    # 有界工作线程池 + 按模型的并发上限：排队任务按提交顺序调度，
+    # 某个模型达到上限时跳过它，让其他模型的任务先执行
+    def __init__(self, max_workers=2, model_limits=None, default_model_limit=1, max_history=100):
+        self.max_workers = max_workers
+        self.model_limits = model_limits or {}
+        self.default_model_limit = default_model_limit
+        self.max_history = max_history
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.queued = []
+        self.running = {}
+        # 任务 id 前缀，预派生多进程模式下标明任务所在的工作进程
+        self.id_prefix = ''
+
+    def submit(self, model_key, func, **kwargs):
+        job = Job(self.id_prefix + uuid.uuid4().hex, model_key, func, kwargs)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.queued.append(job)
+            self.trim_history()
+        self.dispatch()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished():
+                return job
+            job.cancel_event.set()
+            # 尚未开始的任务直接出队
+            if job in self.queued:
+                self.queued.remove(job)
+                job.state = 'cancelled'
+                job.finished_at = time.time()
+        job.notify()
+        return job
+
+    def dispatch(self):
+        with self.lock:
+            for job in list(self.queued):
+                if sum(self.running.values()) >= self.max_workers:
+                    break
+                limit = self.model_limits.get(job.model_key, self.default_model_limit)
+                if self.running.get(job.model_key, 0) >= limit:
+                    continue
+                self.queued.remove(job)
+                self.running[job.model_key] = self.running.get(job.model_key, 0) + 1
+                job.state = 'running'
+                job.started_at = time.time()
+                job.notify()
+                self.executor.submit(self.run, job)
+
+    def run(self, job):
+        try:
+            job.result = job.func(progress=job.progress, **job.kwargs)
+            job.result_info = job.result.get('result_info', job.result_info)
+            job.result_count = job.result.get('result_count', job.result_count)
+            job.frames_done = job.total_frames or job.frames_done
+            job.state = 'done'
+        except JobCancelled:
+            job.state = 'cancelled'
+        except Exception as e:
+            print("任务执行失败:" + job.id, e)
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            job.finished_at = time.time()
+            job.notify()
+            with self.lock:
+                self.running[job.model_key] -= 1
+            self.dispatch()
+
+    def trim_history(self):
+        # 调用方需持有 self.lock；只淘汰已结束的最早任务
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished()]
+        while len(self.jobs) > self.max_history and finished:
+            del self.jobs[finished.pop(0)]
@@ -0,0 +1,126 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter(object):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    metric_type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(object):
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [各分桶计数, 总和, 总数]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, amount, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            value = self.values.get(key)
+            if value is None:
+                value = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value[0][i] += 1
+            value[1] += amount
+            value[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + ('le',)
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{format_labels(names, key + (bound,))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{format_labels(names, key + ("+Inf",))} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('yolo_stage_seconds', 'Time spent in each processing stage.', ['stage'])
+REQUESTS = Counter('yolo_requests_total', 'Requests handled, by route and mode.', ['route', 'mode'])
+IN_FLIGHT = Gauge('yolo_requests_in_flight', 'Requests currently being processed, by route.', ['route'])
+VIDEO_FRAMES = Counter('yolo_video_frames_total', 'Video frames by whether inference ran or was skipped.',
+                       ['result'])
+ALL_METRICS = [STAGE_SECONDS, REQUESTS, IN_FLIGHT, VIDEO_FRAMES]
+
+
+@contextmanager
+def stage_timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe(stage):
+    # 装饰器：统计被装饰函数每次调用的耗时
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_request(route, mode):
+    REQUESTS.inc(route=route, mode=mode)
+    IN_FLIGHT.inc(route=route)
+    try:
+        yield
+    finally:
+        IN_FLIGHT.dec(route=route)
+
+
+def render():
+    # Prometheus 文本格式
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
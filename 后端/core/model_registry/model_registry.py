@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# torch / ultralytics 与车牌识别模块较重，在首次加载模型时才导入，不拖慢服务启动
+
+
+class SharedModel(object):
+    # 对已加载模型的线程安全包装：ultralytics 的 predictor 不是线程安全的，
+    # 同一个模型上的推理调用需要串行执行
+    def __init__(self, path, model, nbytes):
+        self.path = path
+        self.model = model
+        self.nbytes = nbytes
+        self.lock = threading.RLock()
+
+    # 注意：不要传入 stream=True，生成器会在锁外被消费
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            return self.model(*args, **kwargs)
+
+    def predict(self, *args, **kwargs):
+        with self.lock:
+            return self.model.predict(*args, **kwargs)
+
+    def track(self, *args, **kwargs):
+        with self.lock:
+            return self.model.track(*args, **kwargs)
+
+    def reset_tracker(self):
+        # 跟踪器状态保存在 predictor 上，处理新视频前需要清空，避免沿用上一个视频的 id
+        predictor = getattr(self.model, 'predictor', None)
+        for tracker in getattr(predictor, 'trackers', None) or []:
+            tracker.reset()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def module_nbytes(module):
+    # 统计参数与缓冲区占用的字节数，作为模型内存占用的估计
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def load_yolo(model_path):
+    from ultralytics import YOLO
+    model = YOLO(model_path)
+    return model, module_nbytes(model.model)
+
+
+def load_lprnet(model_path):
+    import torch
+    from core.video.video_process.data import CHARS
+    from core.video.video_process.mainProcess import get_parser
+    from core.video.video_process.model import build_lprnet
+    args = get_parser()
+    lprnet = build_lprnet(lpr_max_len=args.lpr_max_len, phase=args.phase_train, class_num=len(CHARS),
+                          dropout_rate=args.dropout_rate)
+    device = torch.device("cuda:0" if args.cuda and torch.cuda.is_available() else "cpu")
+    lprnet.load_state_dict(torch.load(model_path, map_location=device))
+    lprnet.to(device)
+    print("加载模型成功:" + model_path)
+    return lprnet, module_nbytes(lprnet)
+
+
+class ModelRegistry(object):
+    # 进程内共享的模型注册表：每个权重文件只加载一次，
+    # 超出内存预算时按最近最少使用（LRU）淘汰
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}
+        # path -> {'state': pending / warming / ready / failed / evicted, ...}，供就绪检查使用
+        self.status = {}
+
+    def get(self, model_path):
+        model_path = os.path.normpath(model_path)
+        with self.lock:
+            if model_path in self.models:
+                self.models.move_to_end(model_path)
+                return self.models[model_path]
+            # 同一个权重只允许一个线程加载，其余线程等待加载结果
+            event = self.loading.get(model_path)
+            if event is None:
+                event = self.loading[model_path] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            event.wait()
+            return self.get(model_path)
+
+        try:
+            if model_path.endswith('.pth'):
+                model, nbytes = load_lprnet(model_path)
+            else:
+                model, nbytes = load_yolo(model_path)
+            shared = SharedModel(model_path, model, nbytes)
+            with self.lock:
+                self.models[model_path] = shared
+                # 被淘汰后重新加载的模型恢复为可用
+                if self.status.get(model_path, {}).get('state') == 'evicted':
+                    self.status[model_path] = {'state': 'ready'}
+                self.evict()
+            return shared
+        finally:
+            with self.lock:
+                del self.loading[model_path]
+            event.set()
+
+    def evict(self):
+        # 调用方需持有 self.lock；最近使用的模型始终保留。正在推理（锁被占用）的模型不淘汰，
+        # 淘汰了调用方仍持有引用、内存不会释放，下次使用还会重复加载，它们继续计入内存预算
+        if self.max_bytes is None:
+            return
+        for model_path in list(self.models)[:-1]:
+            if self.total_bytes() <= self.max_bytes:
+                break
+            shared = self.models[model_path]
+            if not shared.lock.acquire(blocking=False):
+                continue
+            try:
+                del self.models[model_path]
+            finally:
+                shared.lock.release()
+            if model_path in self.status:
+                self.status[model_path] = {'state': 'evicted'}
+            print("模型已从缓存淘汰:" + model_path)
+
+    def total_bytes(self):
+        return sum(shared.nbytes for shared in self.models.values())
+
+    def preload(self, model_paths):
+        for model_path in model_paths:
+            if os.path.exists(model_path):
+                self.get(model_path)
+
+    def warmup(self, model_path):
+        # 用空白输入执行一次推理，提前完成 Conv+BN 融合与 predictor 初始化
+        model_path = os.path.normpath(model_path)
+        self.status[model_path] = {'state': 'warming'}
+        import numpy as np
+        import torch
+        start = time.perf_counter()
+        try:
+            shared = self.get(model_path)
+            if model_path.endswith('.pth'):
+                device = next(shared.model.parameters()).device
+                with torch.no_grad():
+                    shared(torch.zeros(1, 3, 24, 94, device=device))
+            else:
+                shared(np.zeros((640, 640, 3), np.uint8), verbose=False)
+        except Exception as e:
+            self.status[model_path] = {'state': 'failed', 'error': str(e)}
+            raise
+        self.status[model_path] = {'state': 'ready', 'seconds': round(time.perf_counter() - start, 3)}
+
+    def warmup_all(self, model_paths):
+        # 依次预热，单个模型失败不影响其余模型；未开始的模型标记为 pending
+        for model_path in model_paths:
+            self.status.setdefault(os.path.normpath(model_path), {'state': 'pending'})
+        for model_path in model_paths:
+            try:
+                self.warmup(model_path)
+            except Exception as e:
+                print("模型预热失败:" + model_path, e)
+        evicted = [model_path for model_path in model_paths
+                   if self.status.get(os.path.normpath(model_path), {}).get('state') == 'evicted']
+        if evicted:
+            print("预加载模型超出 MODEL_CACHE_MAX_BYTES，以下模型已被淘汰，使用时重新加载:", evicted)
+
+    def readiness(self, model_paths):
+        # 已预热后被淘汰的模型仍可按需重新加载，视为就绪，否则预加载集合超出内存预算时实例会一直不就绪
+        models = {}
+        for model_path in model_paths:
+            model_path = os.path.normpath(model_path)
+            models[model_path] = self.status.get(model_path, {'state': 'pending'})
+        return all(status['state'] in ('ready', 'evicted') for status in models.values()), models
+
+    def stats(self):
+        with self.lock:
+            return {'max_bytes': self.max_bytes,
+                    'total_bytes': self.total_bytes(),
+                    'models': [{'path': path, 'bytes': shared.nbytes} for path, shared in self.models.items()]}
@@ -0,0 +1,114 @@
+import bisect
+import threading
+
+# Levenshtein 在建树与模糊查找时才导入，导入本模块（服务启动）不依赖它
+
+
+def normalize_plate(plate):
+    return plate.replace(' ', '').upper()
+
+
+class PlateIndex(object):
+    # 车牌检索索引：字典做精确查找，有序列表做前缀（省份/城市代码）查找，
+    # BK 树做编辑距离查找，只需访问与查询距离满足三角不等式的子树
+    def __init__(self):
+        # plate -> [(upload_id, track_id, time), ...]
+        self.postings = {}
+        # 新车牌先追加到末尾，前缀查找前再排序，批量载入时避免逐条插入排序
+        self.sorted_plates = []
+        self.unsorted = False
+        # BK 树节点为 [plate, {distance: child}]
+        self.root = None
+        # 已从数据库载入的最大记录 id，用于增量同步
+        self.last_id = 0
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock()
+
+    def add(self, plate, upload_id, track_id=None, time=None):
+        if not plate:
+            return
+        plate = normalize_plate(plate)
+        with self.lock:
+            postings = self.postings.get(plate)
+            if postings is None:
+                postings = self.postings[plate] = []
+                self.sorted_plates.append(plate)
+                self.unsorted = True
+                self.insert_tree(plate)
+            postings.append((upload_id, track_id, time))
+
+    def sync(self, fetch, batch_size=10000):
+        # 从数据库增量载入新记录；fetch(last_id, limit) 按 id 升序返回
+        # (id, plate, upload_id, track_id, time)。多进程部署时各进程据此看到其他进程写入的车牌
+        with self.sync_lock:
+            while True:
+                rows = fetch(self.last_id, batch_size)
+                for row_id, plate, upload_id, track_id, time in rows:
+                    self.add(plate, upload_id, track_id, time)
+                    self.last_id = max(self.last_id, row_id)
+                if len(rows) < batch_size:
+                    return
+
+    def insert_tree(self, plate):
+        # 调用方需持有 self.lock
+        if self.root is None:
+            self.root = [plate, {}]
+            return
+        import Levenshtein
+        node = self.root
+        while True:
+            distance = Levenshtein.distance(plate, node[0])
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [plate, {}]
+                return
+            node = child
+
+    def exact(self, plate):
+        plate = normalize_plate(plate)
+        with self.lock:
+            if plate in self.postings:
+                return [(plate, 0)]
+            return []
+
+    def prefix(self, prefix, limit=100):
+        prefix = normalize_plate(prefix)
+        with self.lock:
+            if self.unsorted:
+                self.sorted_plates.sort()
+                self.unsorted = False
+            start = bisect.bisect_left(self.sorted_plates, prefix)
+            matches = []
+            for plate in self.sorted_plates[start:start + limit]:
+                if not plate.startswith(prefix):
+                    break
+                matches.append((plate, 0))
+            return matches
+
+    def fuzzy(self, plate, max_distance=1, limit=100):
+        import Levenshtein
+        plate = normalize_plate(plate)
+        matches = []
+        with self.lock:
+            stack = [self.root] if self.root is not None else []
+            while stack:
+                node = stack.pop()
+                distance = Levenshtein.distance(plate, node[0])
+                if distance <= max_distance:
+                    matches.append((node[0], distance))
+                # 三角不等式：只有边权在 [d - k, d + k] 内的子树可能包含结果
+                for edge, child in node[1].items():
+                    if distance - max_distance <= edge <= distance + max_distance:
+                        stack.append(child)
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches[:limit]
+
+    def occurrences(self, plate):
+        with self.lock:
+            return list(self.postings.get(plate, ()))
+
+    def stats(self):
+        with self.lock:
+            return {'plates': len(self.postings),
+                    'occurrences': sum(len(postings) for postings in self.postings.values()),
+                    'last_id': self.last_id}
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from core.metrics.metrics import observe
+
+FONT_PATH = './core/video/video_process/SourceHanSansCN-Heavy.otf'
+
+
+def boxes_to_host(boxes):
+    # 一次性把整帧的检测结果拷回内存，避免逐框索引张量造成多次设备同步；
+    # 返回 xyxy（int）、conf、cls（int）与跟踪 id（未跟踪时为 None）
+    data = boxes.data.cpu().numpy()
+    xyxy = data[:, :4].astype(int)
+    conf = data[:, -2]
+    cls = data[:, -1].astype(int)
+    ids = data[:, 4].astype(int) if data.shape[1] == 7 else None
+    return xyxy, conf, cls, ids
+
+
+class GlyphAtlas(object):
+    # 中文字形缓存：字体只加载一次，每个字符只用 PIL 栅格化一次得到灰度遮罩，
+    # 整串文字的遮罩也按字符串缓存（同一车牌在连续帧中反复出现），绘制时只混合文字所在区域
+    def __init__(self, font_path=FONT_PATH, size=20, preload='', max_strings=1024):
+        from PIL import ImageFont
+        self.font = ImageFont.truetype(font_path, size)
+        ascent, descent = self.font.getmetrics()
+        self.height = ascent + descent
+        self.glyphs = {}
+        self.strings = OrderedDict()
+        self.max_strings = max_strings
+        self.lock = threading.Lock()
+        for char in preload:
+            self.glyph(char)
+
+    def glyph(self, char):
+        mask = self.glyphs.get(char)
+        if mask is None:
+            from PIL import Image, ImageDraw
+            width = max(1, int(np.ceil(self.font.getlength(char))))
+            image = Image.new('L', (width, self.height), 0)
+            ImageDraw.Draw(image).text((0, 0), char, font=self.font, fill=255)
+            mask = self.glyphs[char] = np.asarray(image, dtype=np.float32) / 255.0
+        return mask
+
+    def text_mask(self, text):
+        with self.lock:
+            mask = self.strings.get(text)
+            if mask is not None:
+                self.strings.move_to_end(text)
+                return mask
+            glyphs = [self.glyph(char) for char in text]
+            mask = np.hstack(glyphs) if glyphs else np.zeros((self.height, 0), np.float32)
+            self.strings[text] = mask
+            if len(self.strings) > self.max_strings:
+                self.strings.popitem(last=False)
+            return mask
+
+    def draw(self, image, text, org, color):
+        # 在 org（左上角）处以 color 绘制文字，超出画面的部分被裁剪
+        mask = self.text_mask(text)
+        x, y = org
+        h, w = mask.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, image.shape[1]), min(y + h, image.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return image
+        alpha = mask[y0 - y:y1 - y, x0 - x:x1 - x, None]
+        roi = image[y0:y1, x0:x1]
+        roi[:] = (roi * (1 - alpha) + np.array(color, np.float32) * alpha).astype(np.uint8)
+        return image
+
+
+_atlases = {}
+_atlases_lock = threading.Lock()
+
+
+def get_atlas(font_path=FONT_PATH, size=20, preload=''):
+    # 进程内按 (字体, 字号) 共享字形缓存
+    with _atlases_lock:
+        atlas = _atlases.get((font_path, size))
+        if atlas is None:
+            atlas = _atlases[(font_path, size)] = GlyphAtlas(font_path, size, preload)
+        return atlas
+
+
+@observe('draw')
+def draw_detections(image, boxes, names, colors=None, line_thickness=None):
+    # 画出检测框与 "类别 置信度" 标签，返回 (image, 按 x 坐标排序拼接的类别字符串)；
+    # colors 为按类别索引的颜色列表，None 时统一使用蓝色
+    tl = line_thickness or round(0.002 * (image.shape[0] + image.shape[1]) / 2) + 1  # 线条/字体粗细
+    tf = max(tl - 1, 1)  # 字体粗细
+    xyxy, conf, cls, _ = boxes_to_host(boxes)
+    detected_classes = []
+
+    for (x1, y1, x2, y2), score, cls_id in zip(xyxy.tolist(), conf.tolist(), cls.tolist()):
+        if cls_id >= len(names):
+            print(f"无效的类别ID {cls_id}，超出了名称列表的范围")
+            continue
+
+        color = colors[cls_id] if colors is not None else (255, 0, 0)
+        c1 = (x1, y1)
+        cv2.rectangle(image, c1, (x2, y2), color, thickness=tl, lineType=cv2.LINE_AA)
+        label = f'{names[cls_id]} {score:.2f}'
+        t_size = cv2.getTextSize(label, 0, fontScale=tl / 3, thickness=tf)[0]
+        c2 = c1[0] + t_size[0], c1[1] - t_size[1] - 3
+        # 添加文本背景矩形
+        cv2.rectangle(image, c1, c2, (0, 0, 0), -1, cv2.LINE_AA)
+        cv2.putText(image, label, (c1[0], c1[1] - 2), 0, tl / 3, [225, 255, 255], thickness=tf,
+                    lineType=cv2.LINE_AA)
+        detected_classes.append((x1, names[cls_id]))
+
+    # 根据x坐标对识别结果进行排序，输出预测结果
+    detected_classes.sort(key=lambda x: x[0])
+    return image, ''.join([cls[1] for cls in detected_classes])
+
+
+@observe('draw')
+def draw_plates(image, xyxy, labels, atlas, color=(0, 255, 0)):
+    # 车牌框与中文车牌号，直接在 BGR 图像上绘制
+    for (x1, y1, x2, y2), label in zip(xyxy.tolist(), labels):
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+        atlas.draw(image, f"{label}", (x1, y1 - 30), color)
+    return image
@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(data, mode, conf):
+    # 以图片内容哈希 + 识别模式 + 置信度作为缓存键，与上传文件名无关
+    return f'{hashlib.sha256(data).hexdigest()}:{mode}:{conf}'
+
+
+class ResultCache(object):
+    # 重复上传的识别结果缓存：按总字节数与有效期淘汰，容量不足时先淘汰最近最少使用的条目
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[2] < time.monotonic():
+                self.remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+            return item[0], item[1], item[4]
+
+    def put(self, key, image_info, draw_data, detections=None):
+        # 未渲染结果图时 draw_data 为 None；结构化结果按每个目标约 64 字节估算占用
+        nbytes = len(draw_data or b'') + 64 * len(detections['scores'] if detections else ())
+        with self.lock:
+            if key in self.items:
+                self.remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self.items[key] = (image_info, draw_data, time.monotonic() + self.ttl, nbytes, detections)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                self.remove(next(iter(self.items)))
+
+    def remove(self, key):
+        # 调用方需持有 self.lock
+        item = self.items.pop(key)
+        self.total_bytes -= item[3]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'items': len(self.items),
+                    'bytes': self.total_bytes,
+                    'max_bytes': self.max_bytes,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0}
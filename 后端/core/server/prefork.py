@@ -0,0 +1,82 @@
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+
+import torch
+from werkzeug.serving import make_server
+
+
+def serve(app, host='127.0.0.1', port=5000, workers=2, torch_threads=None, preload=None, post_fork=None,
+          private_port_base=None):
+    # 预派生多进程服务：父进程先加载全部权重，再 fork 出多个工作进程，
+    # 工作进程以写时复制（copy-on-write）方式共享父进程中的权重张量；
+    # private_port_base 不为空时第 i 个工作进程另外监听 127.0.0.1:private_port_base + i，
+    # 其他工作进程把属于它的任务、内存文件与摄像头请求转发到该端口
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+
+    # 父进程只用单线程加载与预热，避免 fork 前创建 OpenMP 线程池导致子进程卡死
+    parent_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    if preload is not None:
+        preload()
+    # 冻结已有对象，子进程中的垃圾回收不再写入这些对象所在的内存页
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = []
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            torch.set_num_threads(torch_threads or max(1, parent_threads // workers))
+            if post_fork is not None:
+                post_fork(index)
+            if private_port_base is not None:
+                private = make_server('127.0.0.1', private_port_base + index, app, threaded=True)
+                threading.Thread(target=private.serve_forever, name='private-server', daemon=True).start()
+            server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+            print(f"工作进程 {index} 已启动, pid={os.getpid()}, torch 线程数={torch.get_num_threads()}")
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        spawn(index)
+    print(f"服务已启动: http://{host}:{port}, 工作进程数={workers}")
+
+    # 回收退出的工作进程，非正常退出时重新拉起
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"工作进程 {index} 退出, status={status}, 重新启动")
+            time.sleep(1)
+            spawn(index)
+    sock.close()
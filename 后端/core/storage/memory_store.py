@@ -0,0 +1,40 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class MemoryStore(object):
+    # 短期内存文件存储：结果图片不落盘时通过 /mem/<key> 临时访问，过期或超出数量后淘汰
+    def __init__(self, ttl=60, max_items=256):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        # key 前缀，预派生多进程模式下标明数据所在的工作进程
+        self.id_prefix = ''
+
+    def put(self, data, mimetype):
+        key = self.id_prefix + uuid.uuid4().hex
+        with self.lock:
+            self.items[key] = (data, mimetype, time.monotonic() + self.ttl)
+            self.expire()
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        return key
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or item[2] < time.monotonic():
+                return None
+            return item[0], item[1]
+
+    def expire(self):
+        # 调用方需持有 self.lock；按写入顺序排列，遇到未过期的即可停止
+        now = time.monotonic()
+        while self.items:
+            key, item = next(iter(self.items.items()))
+            if item[2] >= now:
+                break
+            del self.items[key]
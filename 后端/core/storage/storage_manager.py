@@ -0,0 +1,176 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class StorageManager(object):
+    # 上传文件与结果文件的容量管理：后台线程定期清理超过最长保存时间的文件，
+    # 总大小超出预算时按最近最少访问（LRU）淘汰；处理中的文件可被锁定，不参与淘汰。
+    # 预派生多进程模式下只有一个进程执行清理，锁定记录为 pin_folder 中的标记文件，
+    # 访问时间写入文件的 atime，清理进程据此看到其他进程的锁定与访问
+    def __init__(self, folders, max_bytes=None, max_age=None, interval=60, pin_folder=None):
+        self.folders = folders
+        self.pin_folder = pin_folder
+        if pin_folder is not None and not os.path.exists(pin_folder):
+            os.makedirs(pin_folder)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        # path -> [size, 最近访问时间, 创建时间]，按最近访问排序
+        self.files = OrderedDict()
+        self.pinned = {}
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def track(self, path):
+        # 记录新写入的文件
+        path = os.path.normpath(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        now = time.time()
+        with self.lock:
+            entry = self.files.pop(path, None)
+            created = entry[2] if entry else now
+            self.files[path] = [size, now, created]
+
+    def touch(self, path):
+        # 文件被访问时移到 LRU 队尾，并写入 atime（保留 mtime，即创建时间）
+        path = os.path.normpath(path)
+        now = time.time()
+        try:
+            os.utime(path, (now, os.stat(path).st_mtime))
+        except OSError:
+            pass
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None:
+                entry[1] = now
+                self.files.move_to_end(path)
+
+    def pin_marker(self, path):
+        return os.path.join(self.pin_folder, f'{hashlib.sha1(path.encode()).hexdigest()}.{os.getpid()}')
+
+    def pin(self, *paths):
+        with self.lock:
+            for path in paths:
+                path = os.path.normpath(path)
+                self.pinned[path] = self.pinned.get(path, 0) + 1
+                if self.pinned[path] == 1 and self.pin_folder is not None:
+                    open(self.pin_marker(path), 'w').close()
+
+    def unpin(self, *paths):
+        with self.lock:
+            for path in paths:
+                path = os.path.normpath(path)
+                self.pinned[path] -= 1
+                if self.pinned[path] <= 0:
+                    del self.pinned[path]
+                    if self.pin_folder is not None:
+                        try:
+                            os.remove(self.pin_marker(path))
+                        except OSError:
+                            pass
+
+    def shared_pins(self):
+        # 其他进程锁定的文件（路径哈希）；已退出进程留下的标记文件顺带删除
+        keys = set()
+        if self.pin_folder is None or not os.path.isdir(self.pin_folder):
+            return keys
+        for entry in os.scandir(self.pin_folder):
+            key, _, pid = entry.name.rpartition('.')
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            except (ValueError, OSError):
+                pass
+            keys.add(key)
+        return keys
+
+    def scan(self):
+        # 与磁盘同步：补充未登记的文件（以修改时间作为创建时间），移除已不存在的文件；
+        # 访问时间取内存记录与磁盘 atime 中较新的一个（其他进程的访问只体现在 atime 上），按其重新排序
+        found = {}
+        for folder in self.folders:
+            if not os.path.isdir(folder):
+                continue
+            for entry in os.scandir(folder):
+                if entry.is_file():
+                    stat = entry.stat()
+                    found[os.path.normpath(entry.path)] = (stat.st_size, stat.st_atime, stat.st_mtime)
+        with self.lock:
+            for path in [path for path in self.files if path not in found]:
+                del self.files[path]
+            for path, (size, atime, mtime) in found.items():
+                entry = self.files.get(path)
+                if entry is None:
+                    self.files[path] = [size, max(atime, mtime), mtime]
+                else:
+                    entry[1] = max(entry[1], atime)
+            self.files = OrderedDict(sorted(self.files.items(), key=lambda item: item[1][1]))
+
+    def sweep(self):
+        self.scan()
+        now = time.time()
+        victims = []
+        shared_pins = self.shared_pins()
+        with self.lock:
+            candidates = [path for path in self.files if path not in self.pinned
+                          and hashlib.sha1(path.encode()).hexdigest() not in shared_pins]
+            total = self.total_bytes()
+            for path in candidates:
+                size, _, created = self.files[path]
+                expired = self.max_age is not None and now - created > self.max_age
+                over_budget = self.max_bytes is not None and total > self.max_bytes
+                if expired or over_budget:
+                    victims.append(path)
+                    total -= size
+                    del self.files[path]
+        # 在锁外删除文件，避免阻塞请求线程
+        for path in victims:
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except OSError:
+                pass
+        return victims
+
+    def total_bytes(self):
+        return sum(entry[0] for entry in self.files.values())
+
+    def run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print("清理临时文件失败:", e)
+            time.sleep(self.interval)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='storage-manager', daemon=True)
+            self.thread.start()
+
+    def usage(self):
+        with self.lock:
+            folders = {}
+            for path, entry in self.files.items():
+                folder = folders.setdefault(os.path.dirname(path), {'files': 0, 'bytes': 0})
+                folder['files'] += 1
+                folder['bytes'] += entry[0]
+            return {'max_bytes': self.max_bytes,
+                    'max_age': self.max_age,
+                    'total_bytes': self.total_bytes(),
+                    'files': len(self.files),
+                    'pinned': len(self.pinned),
+                    'evicted': self.evicted,
+                    'folders': folders}
@@ -1,7 +1,15 @@
 import os
+from collections import deque
+
 import cv2
+import numpy as np
 from ultralytics import YOLO
 
+from core.metrics.metrics import VIDEO_FRAMES, stage_timer
+from core.render.render import boxes_to_host, draw_detections
+from core.video.pipeline.pipeline import FrameReader, FrameWriter, TrackWriter, VideoOpenError, batched, open_writer, \
+    sample_step
+
 
 def seconds_to_minutes_seconds(seconds):
     minutes = int(seconds // 60)
@@ -9,88 +17,175 @@ def seconds_to_minutes_seconds(seconds):
     return f'{minutes:02}:{remaining_seconds:02}'
 
 
-def plot_bboxes(image, boxes, names, line_thickness=None):
-    tl = line_thickness or round(0.002 * (image.shape[0] + image.shape[1]) / 2) + 1
-    detected_classes = []
-
-    for box in boxes:
-        x1, y1, x2, y2 = map(int, box.xyxy[0])
-        cls_id = int(box.cls[0])
-        conf = box.conf[0]
-
-        color = (255, 0, 0)
-        c1, c2 = (x1, y1), (x2, y2)
-        cv2.rectangle(image, c1, c2, color, thickness=tl, lineType=cv2.LINE_AA)
-        tf = max(tl - 1, 1)
-        label = f'{names[cls_id]} {conf:.2f}'
-        t_size = cv2.getTextSize(label, 0, fontScale=tl / 3, thickness=tf)[0]
-        c2 = c1[0] + t_size[0], c1[1] - t_size[1] - 3
-
-        text_bg_color = (0, 0, 0)
-        cv2.rectangle(image, c1, c2, text_bg_color, -1, cv2.LINE_AA)
-        cv2.putText(image, label, (c1[0], c1[1] - 2), 0, tl / 3, [225, 255, 255], thickness=tf, lineType=cv2.LINE_AA)
-
-        detected_classes.append((x1, names[cls_id]))
-
-    detected_classes.sort(key=lambda x: x[0])
-    detected_classes_str = ''.join([cls[1] for cls in detected_classes])
-
-    return image, detected_classes_str
-
-
-def video_process(conf, model_path, video_path, save_path, max_attempts=3):
-    model = YOLO(model_path)
-    last_detected_classes_str = ''
+def overlay(boxes, names):
+    # 在编码线程中绘制检测框
+    return lambda frame: draw_detections(frame, boxes, names)[0]
+
+
+def frame_read(boxes, names):
+    # 单帧识别结果：按 x 坐标排序的 (字符, 置信度) 列表
+    xyxy, conf, cls, _ = boxes_to_host(boxes)
+    chars = sorted((x1, names[c], s) for (x1, _, _, _), s, c in zip(xyxy.tolist(), conf.tolist(), cls.tolist())
+                   if c < len(names))
+    return [(char, score) for _, char, score in chars]
+
+
+def track_rows(boxes):
+    # 边车文件中一帧的检测结果：[x1, y1, x2, y2, 置信度, 类别]
+    xyxy, conf, cls, _ = boxes_to_host(boxes)
+    return [box + [round(score, 3), c] for box, score, c in zip(xyxy.tolist(), conf.tolist(), cls.tolist())]
+
+
+class SceneGate(object):
+    # 场景变化门控：缩小后的灰度图与上一次推理的帧逐像素比较，平均绝对差低于 threshold 时
+    # 视为画面未变，直接沿用上一次的检测结果；threshold 不大于 0 时每帧都推理
+    def __init__(self, threshold=2.0, size=(64, 36)):
+        self.threshold = threshold
+        self.size = size
+        self.reference = None
+        self.inferred = 0
+        self.skipped = 0
+
+    def changed(self, frame):
+        if self.threshold <= 0:
+            self.inferred += 1
+            return True
+        thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), self.size,
+                           interpolation=cv2.INTER_AREA).astype(np.int16)
+        if self.reference is not None and np.abs(thumb - self.reference).mean() < self.threshold:
+            self.skipped += 1
+            return False
+        self.reference = thumb
+        self.inferred += 1
+        return True
+
+    def stats(self):
+        return {'frames_inferred': self.inferred, 'frames_skipped': self.skipped}
+
+
+class CaptchaVoter(object):
+    # 时间窗口投票：每帧只推理一次，最近 window 帧中长度正确的识别结果按位置、以置信度加权投票，
+    # 有效帧数不少于 min_votes 且每个位置的得票占比都不低于 min_agreement 时输出该字符串，同一字符串只输出一次
+    def __init__(self, length=5, window=5, min_votes=3, min_agreement=0.6):
+        self.length = length
+        self.min_votes = min_votes
+        self.min_agreement = min_agreement
+        self.reads = deque(maxlen=window)
+        self.last = ''
+
+    def consensus(self, min_votes):
+        reads = [read for read in self.reads if read is not None]
+        if len(reads) < min_votes:
+            return None
+        text = ''
+        for i in range(self.length):
+            scores = {}
+            for chars, _ in reads:
+                scores[chars[i][0]] = scores.get(chars[i][0], 0) + chars[i][1]
+            char, score = max(scores.items(), key=lambda item: item[1])
+            if score < self.min_agreement * sum(scores.values()):
+                return None
+            text += char
+        # 取窗口内最早出现该字符串的帧时间
+        first_seen = min((time for chars, time in reads if ''.join(c for c, _ in chars) == text),
+                         default=reads[0][1])
+        return text, first_seen
+
+    def update(self, chars, time_in_seconds):
+        # 返回新确认的 (字符串, 首次出现时间)，否则返回 None
+        self.reads.append((chars, time_in_seconds) if len(chars) == self.length else None)
+        return self.emit(self.consensus(self.min_votes))
+
+    def flush(self):
+        # 视频结束时窗口可能不足 min_votes 帧，放宽到一帧
+        return self.emit(self.consensus(1))
+
+    def emit(self, result):
+        if result is None or result[0] == self.last:
+            return None
+        self.last = result[0]
+        return result
+
+
+def video_process(conf, model_path, video_path, save_path, model=None, progress=None, vote_window=5, min_votes=3,
+                  min_agreement=0.6, queue_size=8, batch_size=4, scene_threshold=2.0, stats=None, sample_fps=None,
+                  start_frame=0, end_frame=None, track_path=None, fourcc='VP90', quality=None, flush=True):
+    # sample_fps 为目标分析帧率，为空时逐帧分析；save_path 为 None 时不输出标注视频，未采样的帧不解码；
+    # start_frame / end_frame 只处理该帧区间（分段并行处理时使用），时间戳仍按源视频计算；
+    # track_path 不为空时把每个推理帧的检测结果写入 JSON Lines 边车文件，供前端在原视频上绘制；
+    # flush 为 False 时结尾不放宽投票门槛（分段处理中除最后一段外的各段，段尾并不是视频结尾）
+    if model is None:
+        model = YOLO(model_path)
+    voter = CaptchaVoter(length=5, window=vote_window, min_votes=min_votes, min_agreement=min_agreement)
+    gate = SceneGate(scene_threshold)
     detected_classes_str_list = []
 
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
-        print("Error: Could not open video file.")
-        return
+        raise VideoOpenError("Could not open video file")
 
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = cap.get(cv2.CAP_PROP_FPS)
-
-    fourcc = cv2.VideoWriter_fourcc(*'VP90')
-    out = cv2.VideoWriter(save_path, fourcc, fps, (width, height))
-
-    frame_number = 0
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_number += 1
-        time_in_seconds = frame_number / fps
-
-        attempts = 0
-        detected_classes_str = ''
-
-        # 尝试多次检测直到结果符合条件
-        while attempts < max_attempts and len(detected_classes_str) != 5:
-            results = model(frame, conf=conf)
-
-            for r in results:
-                boxes = r.boxes
-                names = r.names
-                im_array = frame.copy()
-
-                im_array, detected_classes_str = plot_bboxes(im_array, boxes, names)
-
-            attempts += 1
-
-        if len(detected_classes_str) == 5 and detected_classes_str != last_detected_classes_str:
-            detected_classes_str_list.append(
-                (len(detected_classes_str_list) + 1, detected_classes_str, seconds_to_minutes_seconds(time_in_seconds)))
-            last_detected_classes_str = detected_classes_str
-
-        out.write(im_array)
-
-    cap.release()
-    out.release()
-    cv2.destroyAllWindows()
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # 解码、推理、绘制与编码三级流水线：解码线程与编码线程通过有界队列与当前线程衔接，输出帧顺序不变
+    reader = FrameReader(cap, queue_size, step=sample_step(fps, sample_fps), decode_skipped=save_path is not None,
+                         start=start_frame, end=end_frame)
+    writer = None
+    if save_path is not None:
+        writer = FrameWriter(open_writer(save_path, fps, (width, height), fourcc, quality), queue_size)
+    track = None
+    if track_path is not None:
+        track = TrackWriter(track_path, fps, (width, height), model.names)
+
+    # 进度回调可抛出异常以取消处理，保证视频句柄总能被释放
+    try:
+        r = None
+        for batch in batched(reader, batch_size, queue_size):
+            # 采样且画面有变化的帧才推理，batch_size 帧合成一次批量前向，结果按帧顺序交给时间窗口投票；
+            # 未变化的帧沿用上一次推理的检测结果，未采样的帧只沿用绘制、不参与投票
+            changed = [sampled and gate.changed(frame) for _, frame, sampled in batch]
+            frames = [frame for (_, frame, _), flag in zip(batch, changed) if flag]
+            results = []
+            if frames:
+                with stage_timer('yolo_inference'):
+                    results = model(frames, conf=conf)
+            results = iter(results)
+            for (frame_number, frame, sampled), flag in zip(batch, changed):
+                if flag:
+                    r = next(results)
+                    if track is not None:
+                        track.write(frame_number, track_rows(r.boxes))
+                frame_number += 1
+                time_in_seconds = frame_number / fps
+                if writer is not None:
+                    writer.put(frame, overlay(r.boxes, r.names))
+
+                if sampled:
+                    confirmed = voter.update(frame_read(r.boxes, r.names), time_in_seconds)
+                    if confirmed is not None:
+                        detected_classes_str_list.append((len(detected_classes_str_list) + 1, confirmed[0],
+                                                          seconds_to_minutes_seconds(confirmed[1])))
+
+                if progress is not None:
+                    progress(frame_number, total_frames, detected_classes_str_list)
+        confirmed = voter.flush() if flush else None
+        if confirmed is not None:
+            detected_classes_str_list.append((len(detected_classes_str_list) + 1, confirmed[0],
+                                              seconds_to_minutes_seconds(confirmed[1])))
+    finally:
+        reader.close()
+        if writer is not None:
+            writer.close()
+        if track is not None:
+            track.close()
+        cv2.destroyAllWindows()
+        VIDEO_FRAMES.inc(gate.inferred, result='inferred')
+        VIDEO_FRAMES.inc(gate.skipped, result='skipped')
+        VIDEO_FRAMES.inc(reader.unsampled, result='unsampled')
+        if stats is not None:
+            stats.update(gate.stats(), frames_unsampled=reader.unsampled)
 
     return detected_classes_str_list
 
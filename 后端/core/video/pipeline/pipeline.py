@@ -0,0 +1,183 @@
+import json
+import queue
+import threading
+
+import cv2
+
+from core.metrics.metrics import stage_timer
+
+# 队列结束标记
+_END = object()
+
+
+class VideoOpenError(IOError):
+    # 视频文件无法打开（格式不支持或文件损坏）
+    pass
+
+
+def open_writer(path, fps, size, fourcc='VP90', quality=None):
+    # 按配置的编码器打开视频写入器；quality（0-100）只有部分后端支持（如 OpenCV 内置的 MJPG），
+    # 不支持时忽略该参数重新打开
+    if quality is not None:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size,
+                                 [cv2.VIDEOWRITER_PROP_QUALITY, int(quality)])
+        if writer.isOpened():
+            return writer
+        print(f"编码器 {fourcc} 不支持 quality 参数，使用默认质量")
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+
+
+class TrackWriter(object):
+    # 检测轨迹边车文件（JSON Lines），代替重新编码标注视频：首行为视频信息与字段说明，
+    # 之后每个推理帧一行 {"f": 帧序号, "t": 秒, "d": [[字段...], ...]}，
+    # 前端在原视频上按播放时间绘制，两行之间沿用前一行的结果
+    def __init__(self, path, fps, size, names, fields=('x1', 'y1', 'x2', 'y2', 'conf', 'cls'), header=True):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.fps = fps
+        if header:
+            self.dump({'fps': fps, 'width': size[0], 'height': size[1], 'names': names, 'fields': list(fields)})
+
+    def dump(self, item):
+        self.file.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def write(self, frame_number, detections):
+        self.dump({'f': frame_number, 't': round(frame_number / self.fps, 3), 'd': detections})
+
+    def close(self):
+        self.file.close()
+
+
+def sample_step(fps, sample_fps):
+    # 目标分析帧率对应的采样间隔（源帧数，可为小数）；sample_fps 为空或不低于源帧率时逐帧分析
+    if not sample_fps or not fps or sample_fps >= fps:
+        return 1.0
+    return fps / sample_fps
+
+
+class FrameReader(object):
+    # 解码线程：逐帧读取放入有界队列，队列满时阻塞解码（背压），内存占用不随视频长度增长；
+    # 按顺序迭代得到 (帧序号, 帧, 是否采样)，帧序号从 0 开始，按源视频计数。
+    # step > 1 时每隔 step 帧采样一帧用于分析；decode_skipped 为 False 时未采样的帧只 grab()
+    # 不解码也不输出，为 True 时照常解码输出（需要逐帧写出标注视频时）。
+    # start / end 限定读取的帧区间 [start, end)，end 为 None 时读到结尾
+    def __init__(self, cap, queue_size=8, step=1.0, decode_skipped=True, start=0, end=None):
+        self.cap = cap
+        self.start = start
+        self.end = end
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.step = step
+        self.decode_skipped = decode_skipped
+        self.unsampled = 0
+        self.stopped = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='video-decode', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        frame_number = self.start
+        next_sample = float(self.start)
+        try:
+            while not self.stopped.is_set() and (self.end is None or frame_number < self.end):
+                sampled = frame_number + 1e-6 >= next_sample
+                if sampled or self.decode_skipped:
+                    with stage_timer('decode'):
+                        ret, frame = self.cap.read()
+                else:
+                    with stage_timer('grab'):
+                        ret, frame = self.cap.grab(), None
+                if not ret:
+                    break
+                if sampled:
+                    next_sample += self.step
+                else:
+                    self.unsampled += 1
+                if sampled or self.decode_skipped:
+                    self.put((frame_number, frame, sampled))
+                frame_number += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.put(_END)
+
+    def put(self, item):
+        # 消费方已停止时不再阻塞
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.cap.release()
+
+
+def batched(frames, batch_size, max_frames=None):
+    # 把 (帧序号, 帧, 是否采样) 按顺序分组，每组最多 batch_size 个采样帧，用于多帧批量推理；
+    # 未采样的帧随所在位置留在组内。组内总帧数不超过 max_frames（不小于 batch_size），
+    # 低采样率下输出标注视频时，未采样的整帧不会在一组中大量堆积，内存占用仍由队列长度限定
+    max_frames = max(batch_size, max_frames or batch_size)
+    batch = []
+    count = 0
+    for item in frames:
+        batch.append(item)
+        if item[2]:
+            count += 1
+        if count >= batch_size or len(batch) >= max_frames:
+            yield batch
+            batch = []
+            count = 0
+    if batch:
+        yield batch
+
+
+class FrameWriter(object):
+    # 渲染/编码线程：按提交顺序对每帧执行 draw(frame)（可为 None）后写入视频，
+    # 绘制与编码和推理并行；队列满时 put 阻塞（背压）
+    def __init__(self, writer, queue_size=8):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='video-encode', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                return
+            if self.error is not None:
+                continue
+            frame, draw = item
+            try:
+                if draw is not None:
+                    frame = draw(frame)
+                with stage_timer('encode_write'):
+                    self.writer.write(frame)
+            except Exception as e:
+                self.error = e
+
+    def put(self, frame, draw=None):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((frame, draw))
+
+    def close(self):
+        self.queue.put(_END)
+        self.thread.join()
+        self.writer.release()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,201 @@
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from core.video.pipeline.pipeline import open_writer
+
+# 工作进程内的模型缓存，每个进程只加载一次权重
+_models = {}
+
+
+def init_worker(threads):
+    # 各工作进程平分 CPU，避免 torch 线程数超订
+    import torch
+    torch.set_num_threads(threads)
+
+
+def load_model(model_path):
+    model = _models.get(model_path)
+    if model is None:
+        from ultralytics import YOLO
+        model = _models[model_path] = YOLO(model_path)
+    return model
+
+
+def process_segment(conf, model_path, video_path, save_path, track_path, start, end, options):
+    # 在工作进程中处理 [start, end) 帧区间，返回 (识别结果, 帧统计)
+    from core.video.code_video.code_video import video_process
+    stats = {}
+    result_list = video_process(conf, model_path, video_path, save_path, model=load_model(model_path),
+                                stats=stats, start_frame=start, end_frame=end, track_path=track_path,
+                                flush=end is None, **options)
+    return result_list, stats
+
+
+def probe_keyframes(video_path, fps):
+    # 用 ffprobe 读取关键帧位置（帧序号），没有 ffprobe 或读取失败时返回 None
+    if shutil.which('ffprobe') is None or not fps:
+        return None
+    try:
+        output = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+                                 '-show_entries', 'frame=pts_time', '-of', 'csv=p=0', video_path],
+                                capture_output=True, text=True, timeout=60, check=True).stdout
+    except (subprocess.SubprocessError, OSError) as e:
+        print("读取关键帧失败:", e)
+        return None
+    return sorted({int(round(float(line.strip().rstrip(',')) * fps))
+                   for line in output.splitlines() if line.strip().rstrip(',')})
+
+
+def plan_segments(total_frames, fps, workers, min_seconds, keyframes=None):
+    # 按时长平均切成不超过 workers 段、每段不短于 min_seconds，切点对齐到最近的关键帧；
+    # 最后一段读到视频结尾（帧数元数据可能不准）
+    count = min(workers, int(total_frames / max(fps * min_seconds, 1)))
+    if count < 2:
+        return [(0, None)]
+    bounds = [0]
+    for i in range(1, count):
+        target = total_frames * i // count
+        if keyframes:
+            target = min(keyframes, key=lambda keyframe: abs(keyframe - target))
+        if bounds[-1] < target < total_frames:
+            bounds.append(target)
+    bounds.append(None)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def merge_results(segment_results):
+    # 按段顺序合并识别结果并重新编号；相邻两段在切点两侧识别出同一字符串时只保留前一条
+    merged = []
+    for result_list in segment_results:
+        for i, (_, text, time) in enumerate(result_list):
+            if i == 0 and merged and merged[-1][1] == text:
+                continue
+            merged.append((len(merged) + 1, text, time))
+    return merged
+
+
+def concat_videos(part_paths, save_path, fps, size, fourcc='VP90', quality=None):
+    # 有 ffmpeg 时直接拼接码流不重新编码，否则用 OpenCV 逐帧读出再写入
+    if shutil.which('ffmpeg') is not None:
+        fd, list_path = tempfile.mkstemp(suffix='.txt')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for path in part_paths:
+                    f.write(f"file '{os.path.abspath(path)}'\n")
+            subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+                            '-c', 'copy', save_path], check=True, timeout=600)
+            return
+        except (subprocess.SubprocessError, OSError) as e:
+            print("ffmpeg 拼接失败，改用 OpenCV:", e)
+        finally:
+            os.remove(list_path)
+    out = open_writer(save_path, fps, size, fourcc, quality)
+    try:
+        for path in part_paths:
+            cap = cv2.VideoCapture(path)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                out.write(frame)
+            cap.release()
+    finally:
+        out.release()
+
+
+def concat_tracks(part_paths, track_path):
+    # 各段边车文件的帧序号已是源视频序号，只保留第一段的首行视频信息
+    with open(track_path, 'w', encoding='utf-8') as out:
+        for i, path in enumerate(part_paths):
+            with open(path, encoding='utf-8') as f:
+                if i > 0:
+                    f.readline()
+                shutil.copyfileobj(f, out)
+
+
+class SegmentRunner(object):
+    # 长视频分段并行处理：在关键帧处切成若干时间段，交给进程池中的工作进程（各自持有模型）处理，
+    # 再拼接标注视频、合并识别结果。进程池首次使用时创建，使用 spawn 启动，不继承父进程的 CUDA / 线程状态
+    def __init__(self, workers=4, min_seconds=10):
+        self.workers = workers
+        self.min_seconds = min_seconds
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=init_worker, initargs=(threads,))
+            return self.executor
+
+    def plan(self, video_path):
+        cap = cv2.VideoCapture(video_path)
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        finally:
+            cap.release()
+        if self.workers < 2 or not fps or total_frames <= 0:
+            return fps, total_frames, size, [(0, None)]
+        keyframes = probe_keyframes(video_path, fps)
+        return fps, total_frames, size, plan_segments(total_frames, fps, self.workers, self.min_seconds, keyframes)
+
+    def run(self, conf, model_path, video_path, save_path, segments, fps, total_frames, size, progress=None,
+            stats=None, track_path=None, **options):
+        # progress 在每段完成时以已完成的帧数回调，可抛出异常以取消尚未开始的分段；
+        # 各段完成顺序不定，识别结果只上报从第一段起连续完成的部分，保证已上报的结果只会在末尾追加
+        part_paths = part_tracks = []
+        if save_path is not None:
+            root, ext = os.path.splitext(save_path)
+            part_paths = [f'{root}.part{i}{ext}' for i in range(len(segments))]
+        if track_path is not None:
+            root, ext = os.path.splitext(track_path)
+            part_tracks = [f'{root}.part{i}{ext}' for i in range(len(segments))]
+        executor = self.get_executor()
+        futures = {}
+        for i, (start, end) in enumerate(segments):
+            future = executor.submit(process_segment, conf, model_path, video_path,
+                                     part_paths[i] if part_paths else None,
+                                     part_tracks[i] if part_tracks else None, start, end, options)
+            futures[future] = i
+        segment_results = [None] * len(segments)
+        done_frames = 0
+        leading = 0
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                result_list, segment_stats = future.result()
+                segment_results[i] = result_list
+                if stats is not None:
+                    for key, value in segment_stats.items():
+                        stats[key] = stats.get(key, 0) + value
+                start, end = segments[i]
+                done_frames += (end if end is not None else total_frames) - start
+                while leading < len(segments) and segment_results[leading] is not None:
+                    leading += 1
+                if progress is not None:
+                    progress(done_frames, total_frames, merge_results(segment_results[:leading]))
+            if part_paths:
+                concat_videos(part_paths, save_path, fps, size, options.get('fourcc', 'VP90'), options.get('quality'))
+            if part_tracks:
+                concat_tracks(part_tracks, track_path)
+        finally:
+            for future in futures:
+                future.cancel()
+            for path in part_paths + part_tracks:
+                if os.path.exists(path):
+                    os.remove(path)
+        return merge_results(segment_results)
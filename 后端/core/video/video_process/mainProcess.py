@@ -4,9 +4,12 @@ import time
 from collections import Counter
 
 import cv2
-import numpy as np
 from ultralytics import YOLO, solutions
 
+from core.metrics.metrics import stage_timer
+from core.render.render import boxes_to_host, draw_plates, get_atlas
+from core.video.pipeline.pipeline import FrameReader, FrameWriter, TrackWriter, VideoOpenError, batched, open_writer, \
+    sample_step
 from core.video.video_process import run_LPRNet
 from core.video.video_process.data import CHARS
 from core.video.video_process.image_correction import image_correction
@@ -15,14 +18,13 @@ from core.video.video_process.model import build_lprnet
 
 import torch
 
-from PIL import Image, ImageDraw, ImageFont
 import Levenshtein
 
 
-def mainProcess(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
+def mainProcess(YOLOmodelPath, LPRNetModelPath, dataPath, savePath, fourcc='mp4v', quality=None):
     #初始化
-    #加载字体
-    font = ImageFont.truetype('./core/video/video_process/SourceHanSansCN-Heavy.otf', 20)
+    #加载字体，字形缓存在进程内共享
+    atlas = get_atlas(preload=CHARS)
     # 导入模型
     model = YOLO(YOLOmodelPath)
     print("导入模型成功:" + YOLOmodelPath)
@@ -42,11 +44,10 @@ def mainProcess(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
     cap = cv2.VideoCapture(dataPath)
     base_name = os.path.splitext(os.path.basename(dataPath))[0]
     if isVideo:
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
         fps = cap.get(cv2.CAP_PROP_FPS)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        video = cv2.VideoWriter(savePath, fourcc, fps, (width, height))
+        video = open_writer(savePath, fps, (width, height), fourcc, quality)
         savePath = os.path.join(savePath, base_name + '_检测结果.mp4')
     else:
         savePath = os.path.join(savePath, base_name + '_检测结果.png')
@@ -63,10 +64,12 @@ def mainProcess(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
     results = model.predict(dataPath, stream=True, conf=0.1)
     for result in results:
         start_time = time.time()
+        xyxy = boxes_to_host(result.boxes)[0]
         # 将图像分割
-        cimages = crop_boxes_from_image(result)
+        cimages = crop_boxes_from_image(result, xyxy)
         # 使用lprnet处理
-        labels = run_LPRNet.Predict(lprnet, cimages, args)
+        with stage_timer('lprnet_inference'):
+            labels = run_LPRNet.Predict(lprnet, cimages, args)
         # 进行标记
         lbs = []
         for label in labels:
@@ -75,7 +78,7 @@ def mainProcess(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
                 lb += CHARS[i]
             print(lb)
             lbs.append(lb)
-        fimg = draw_boxes(result, lbs, font)
+        fimg = draw_plates(result.orig_img, xyxy, lbs, atlas)
         end_time = time.time()
         print(str(end_time - start_time))
         # 重新将图片合成为视频
@@ -92,15 +95,15 @@ def mainProcess(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
         cap.release()
 
 
-def crop_boxes_from_image(result):
+def crop_boxes_from_image(result, xyxy=None):
     image = result.orig_img
-    boxes = result.boxes
+    if xyxy is None:
+        xyxy = boxes_to_host(result.boxes)[0]
     cropped_images = []
-    for xyxy in boxes.xyxy:
-        x1, y1, x2, y2 = xyxy
-        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+    for x1, y1, x2, y2 in xyxy.tolist():
         cropped_image = image[y1:y2, x1:x2]
-        cropped_image = image_correction(cropped_image)
+        with stage_timer('image_correction'):
+            cropped_image = image_correction(cropped_image)
         cropped_images.append(cropped_image)
     return cropped_images
 
@@ -117,32 +120,20 @@ def get_parser():
     parser.add_argument('--show', default=False, type=bool, help='show test image and its predict result or not.')
     parser.add_argument('--pretrained_model', default='./weights/Final_LPRNet_model.pth', help='pretrained base model')
 
-    args = parser.parse_args()
+    # 忽略服务启动参数等无关的命令行参数
+    args, _ = parser.parse_known_args()
 
     return args
 
-def draw_boxes(result, labels, font):
-    image = result.orig_img
-    boxes = result.boxes
-    for xyxy, label in zip(boxes.xyxy, labels):
-        x1, y1, x2, y2 = xyxy
-        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-        # 绘制边界框
-        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)  # 绿色边框，线宽为2
-        # 添加类别名称和置信度
-        label = f"{label}"
-        image_pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        draw = ImageDraw.Draw(image_pil)
-        draw.text((x1, y1 - 30), label, font=font, fill=(0, 255, 0, 0))
-        image = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
-        # cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-    return image
-
-
-def countCar(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
-    model = YOLO(YOLOmodelPath)
+def countCar(YOLOmodelPath, LPRNetModelPath, dataPath, savePath, model=None, lprnet=None, progress=None,
+             queue_size=8, batch_size=4, sample_fps=None, track_path=None, fourcc='VP90', quality=None):
+    # sample_fps 为目标分析帧率，为空时逐帧跟踪；savePath 为 None 时不输出标注视频，未采样的帧不解码；
+    # track_path 不为空时把每个跟踪帧的车牌框、跟踪 id 与车牌号写入 JSON Lines 边车文件
+    if model is None:
+        model = YOLO(YOLOmodelPath)
     cap = cv2.VideoCapture(dataPath)
-    assert cap.isOpened(), "Error reading video file"
+    if not cap.isOpened():
+        raise VideoOpenError("Could not open video file")
     w, h, fps = (int(cap.get(x)) for x in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     frame_interval = 1 / fps
@@ -152,9 +143,6 @@ def countCar(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
     line_points = [(0, 400), (1080, 400)]
     region_points = [(0, 500), (10800, 500), (10800, 600), (0, 600)]
 
-    # Video writer
-    video_writer = cv2.VideoWriter(savePath, cv2.VideoWriter_fourcc(*"VP90"), fps, (w, h))
-
     # Init Object Counter
     counter = solutions.ObjectCounter(
         view_img=True,
@@ -168,80 +156,131 @@ def countCar(YOLOmodelPath, LPRNetModelPath, dataPath, savePath):
     )
 
     #LPRNet初始化
-    font = ImageFont.truetype('./core/video/video_process/SourceHanSansCN-Heavy.otf', 20)
+    atlas = get_atlas(preload=CHARS)
     # LPRNet网络构建
     args = get_parser()
-    lprnet = build_lprnet(lpr_max_len=args.lpr_max_len, phase=args.phase_train, class_num=len(CHARS),
-                          dropout_rate=args.dropout_rate)
-    device = torch.device("cuda:0" if args.cuda else "cpu")
-    lprnet.to(device)
-    print("成功构建网络")
-    # LPRNet模型加载
-    if args.pretrained_model:
-        lprnet.load_state_dict(torch.load(LPRNetModelPath))
-        print("加载模型成功:" + args.pretrained_model)
-    else:
-        print("[Error] 无法找到模型：" + args.pretrained_model)
-        return False
+    if lprnet is None:
+        lprnet = build_lprnet(lpr_max_len=args.lpr_max_len, phase=args.phase_train, class_num=len(CHARS),
+                              dropout_rate=args.dropout_rate)
+        device = torch.device("cuda:0" if args.cuda else "cpu")
+        lprnet.to(device)
+        print("成功构建网络")
+        # LPRNet模型加载
+        if args.pretrained_model:
+            lprnet.load_state_dict(torch.load(LPRNetModelPath))
+            print("加载模型成功:" + args.pretrained_model)
+        else:
+            print("[Error] 无法找到模型：" + args.pretrained_model)
+            return False
 
     # 车牌识别结果存储
     results_list = []
 
+    def plates():
+        # 进度回调按需汇总，由任务在处理线程中限频调用，不必每帧汇总
+        return summarize_plates(results_list)
+
+    def overlay(xyxy, lbs):
+        # 在编码线程中按帧顺序绘制车牌
+        return lambda frame: draw_plates(frame, xyxy, lbs, atlas)
+
+    # 解码、推理、绘制与编码三级流水线，跟踪器仍按顺序逐帧处理
+    reader = FrameReader(cap, queue_size, step=sample_step(fps, sample_fps), decode_skipped=savePath is not None)
+    writer = None
+    if savePath is not None:
+        # Video writer
+        video_writer = open_writer(savePath, fps, (w, h), fourcc, quality)
+        writer = FrameWriter(video_writer, queue_size)
+    track = None
+    if track_path is not None:
+        track = TrackWriter(track_path, fps, (w, h), model.names,
+                            fields=('x1', 'y1', 'x2', 'y2', 'conf', 'cls', 'id', 'label'))
     frame_number = 0
-    while cap.isOpened():
-        current_time = frame_number * frame_interval
-        success, im0 = cap.read()
-        if not success:
-            print("Video frame is empty or video processing has been successfully completed.")
-            break
-        tracks = model.track(im0, persist=True, show=False)
-        result = tracks[0]
-        # 将图像分割
-        cimages = crop_boxes_from_image(result)
-        # 使用lprnet处理
-        labels = run_LPRNet.Predict(lprnet, cimages, args)
-        # 进行标记
-        lbs = []
-        for label in labels:
-            lb = ""
-            for i in label:
-                lb += CHARS[i]
-            print(lb)
-            lbs.append(lb)
-        #将结果存入结果数组
-        if result.boxes.id is not None:
-            for lb, id in zip(lbs, result.boxes.id):
-                isSaved = False
-                point = None
-                # 检查是否已有id
-                for num, ls, time in results_list:
-                    if num == id:
-                        isSaved = True
-                        point = (num, ls)
-                # 若存在，则加入其中
-                if isSaved:
-                    point[1].add(lb)
-                # 若不存在，则新建项
-                else:
-                    results_list.append([id, {lb}, seconds_to_minutes_seconds(current_time)])
-        fimg = draw_boxes(result, lbs, font)
-        im0 = counter.start_counting(fimg, tracks)
-        if tracks[0].boxes.id is not None:
-            print(tracks[0].boxes.id.int().cpu())
-        video_writer.write(fimg)
-        frame_number += 1
-
-    cap.release()
-    video_writer.release()
-    cv2.destroyAllWindows()
+    draw = None
+    # 进度回调可抛出异常以取消处理，保证视频句柄总能被释放
+    try:
+        for batch in batched(reader, batch_size, queue_size):
+            # 采样帧合成一次批量前向；列表输入时所有帧共用同一个跟踪器，并按帧顺序依次更新
+            sampled_frames = [im0 for _, im0, sampled in batch if sampled]
+            tracks = []
+            if sampled_frames:
+                with stage_timer('yolo_inference'):
+                    tracks = model.track(sampled_frames, persist=True, show=False)
+            tracks = iter(tracks)
+            for frame_number, im0, sampled in batch:
+                if not sampled:
+                    # 未采样的帧沿用上一采样帧的车牌绘制
+                    if writer is not None:
+                        writer.put(im0, draw)
+                    if progress is not None:
+                        progress(frame_number + 1, total_frames, plates, counter.in_counts)
+                    continue
+                result = next(tracks)
+                current_time = frame_number * frame_interval
+                xyxy, scores, classes, track_ids = boxes_to_host(result.boxes)
+                # 将图像分割
+                cimages = crop_boxes_from_image(result, xyxy)
+                # 使用lprnet处理
+                with stage_timer('lprnet_inference'):
+                    labels = run_LPRNet.Predict(lprnet, cimages, args)
+                # 进行标记
+                lbs = []
+                for label in labels:
+                    lb = ""
+                    for i in label:
+                        lb += CHARS[i]
+                    print(lb)
+                    lbs.append(lb)
+                if track is not None:
+                    ids = track_ids.tolist() if track_ids is not None else [None] * len(lbs)
+                    track.write(frame_number, [box + [round(score, 3), c, i, lb] for box, score, c, i, lb in
+                                               zip(xyxy.tolist(), scores.tolist(), classes.tolist(), ids, lbs)])
+                #将结果存入结果数组
+                if result.boxes.id is not None:
+                    for lb, id in zip(lbs, result.boxes.id):
+                        isSaved = False
+                        point = None
+                        # 检查是否已有id
+                        for num, ls, time in results_list:
+                            if num == id:
+                                isSaved = True
+                                point = (num, ls)
+                        # 若存在，则加入其中
+                        if isSaved:
+                            point[1].add(lb)
+                        # 若不存在，则新建项
+                        else:
+                            results_list.append([id, {lb}, seconds_to_minutes_seconds(current_time)])
+                # 计数在推理线程中逐个采样帧进行，不依赖是否输出标注视频；不输出视频时在副本上绘制计数区域
+                counter.start_counting(im0 if writer is not None else im0.copy(), [result])
+                draw = overlay(xyxy, lbs)
+                if writer is not None:
+                    writer.put(im0, draw)
+                if result.boxes.id is not None:
+                    print(result.boxes.id.int().cpu())
+                if progress is not None:
+                    progress(frame_number + 1, total_frames, plates, counter.in_counts)
+        print("Video frame is empty or video processing has been successfully completed.")
+    finally:
+        reader.close()
+        if writer is not None:
+            writer.close()
+        if track is not None:
+            track.close()
+        cv2.destroyAllWindows()
+    result_list = summarize_plates(results_list)
+    print(result_list)
+    print(results_list)
+    return result_list, counter.in_counts
+
+def summarize_plates(results_list):
+    # 每个跟踪 id 取出现最多的车牌字符串作为识别结果
     result_list = []
     id = 0
     for num, lbs, time in results_list:
         result_list.append([id, get_most_frequent_string(lbs), time])
         id += 1
-    print(result_list)
-    print(results_list)
-    return result_list, counter.in_counts
+    return result_list
 
 def seconds_to_minutes_seconds(seconds):
     minutes = int(seconds // 60)